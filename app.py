@@ -1,7 +1,7 @@
 import streamlit as st
 from triage_core import (
-    initialise_drug_config,
-    load_tripsit_combos,
+    start_reloader,
+    start_warmup,
     triage_from_text_and_context,
 )
 
@@ -10,8 +10,17 @@ from triage_core import (
 # -------------------------------------------------------------------------
 @st.cache_resource
 def init_engine():
-    initialise_drug_config(tripsit_path="drugs.json")
-    load_tripsit_combos("combos.json")
+    # Loads triage_kb.snapshot when it matches the inputs, else rebuilds it.
+    # Runs in the background; "Run triage" waits for it (ensure_ready)
+    paths = dict(
+        tripsit_path="drugs.json",
+        lexicon_path="non_drug_words.txt",
+        combos_path="combos.json",
+        snapshot_path="triage_kb.snapshot",
+    )
+    start_warmup(**paths)
+    # Picks up edited drugs.json / combos.json without a restart
+    start_reloader(interval=30.0, **paths)
     return True
 
 
@@ -121,6 +130,13 @@ if result is not None:
     if result["unknown_drugs"]:
         st.write(f"**Unknown drugs (flagged):** {', '.join(result['unknown_drugs'])}")
 
+    if result.get("drug_quantities"):
+        reported = "; ".join(
+            f"{drug} ({', '.join(quantities)})"
+            for drug, quantities in result["drug_quantities"].items()
+        )
+        st.write(f"**Reported amounts / routes:** {reported}")
+
     st.write(f"**Drug score (acute pharmacological risk):** {result['drug_score']}")
     st.write(f"- Category synergy component: {result['synergy_component']}")
     st.write(f"- TripSit combo component: {result['tripsit_combo_component']}")
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import triage_core  # noqa: E402
+
+KB_PATHS = dict(
+    tripsit_path=os.path.join(ROOT, "drugs.json"),
+    lexicon_path=os.path.join(ROOT, "non_drug_words.txt"),
+    combos_path=os.path.join(ROOT, "combos.json"),
+)
+
+
+@pytest.fixture(scope="session")
+def kb():
+    """triage_core initialised from the bundled drugs/combos/lexicon files."""
+    triage_core.initialise_drug_config(**KB_PATHS)
+    return triage_core
+
+
+@pytest.fixture
+def fresh_kb(kb):
+    """kb for a test that changes it; initialised again afterwards."""
+    yield kb
+    kb.initialise_drug_config(**KB_PATHS)
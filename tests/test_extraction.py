@@ -0,0 +1,106 @@
+import pytest
+
+
+@pytest.mark.parametrize("text, drugs", [
+    ("ket at 6 am", ["ketamine"]),
+    ("found unresponsive at 6 am", []),
+    ("what do i do", []),
+    ("took 2 k 2 hours ago", ["ketamine"]),
+])
+def test_ordinary_speech_is_not_joined_into_a_drug(kb, text, drugs):
+    assert kb.extract_drugs(text) == (drugs, [])
+
+
+def test_one_letter_words_are_not_joined(kb):
+    found, _ = kb.extract_drugs("then a f shot")
+    assert "acetylfentanyl" not in found
+
+
+@pytest.mark.parametrize("text, drug", [
+    ("5f adb", "5f-adb"),
+    ("mdmb 4en pinaca", "mdmb-4en-pinaca"),
+    ("2c b", "2c-b"),
+    ("4 aco dmt", "4-aco-dmt"),
+    ("took 5F–ADB", "5f-adb"),
+])
+def test_spaced_chemical_names_are_joined(kb, text, drug):
+    assert kb.extract_drugs(text) == ([drug], [])
+
+
+@pytest.mark.parametrize("word", ["open", "term", "faint", "nature", "music", "benzos"])
+def test_phonetic_matches_stay_within_the_distance_budget(kb, word):
+    assert kb.resolve_drug_token(word).path != "phonetic"
+    assert kb.extract_drugs(word) == ([word], [word])
+
+
+def test_phonetic_stage_reaches_past_the_fuzzy_budget(kb):
+    resolution = kb.resolve_drug_token("ketamean")
+    assert (resolution.canonical, resolution.path, resolution.distance) == ("ketamine", "phonetic", 3)
+
+
+@pytest.mark.parametrize("token, drug", [
+    ("uetazolam", "ketazolam"),
+    ("aiphenidine", "diphenidine"),
+    ("4-aho-dmt", "4-aco-dmt"),
+    ("25i-nboue", "25i-nbome"),
+])
+def test_closer_fuzzy_match_beats_phonetic_key(kb, token, drug):
+    resolution = kb.resolve_drug_token(token)
+    assert (resolution.canonical, resolution.path, resolution.distance) == (drug, "fuzzy", 1)
+
+
+@pytest.mark.parametrize("text, drug", [
+    ("took 2 x last night", "mdma"),
+    ("dropped 2 tabs", "lsd"),
+])
+def test_count_before_slang_keeps_the_drug(kb, text, drug):
+    found, _, spans = kb.extract_drugs(text, with_spans=True)
+    assert drug in found
+    assert kb.drug_quantities(spans)[drug] == ["2"]
+
+
+def test_im_is_not_a_route(kb):
+    assert kb.extract_drugs("im on 2 tabs") == (["lsd"], [])
+
+
+@pytest.mark.parametrize("text, drug", [
+    ("smoked crystal meth", "methamphetamine"),
+    ("synthetic cannabinoids and alcohol", "generic_synthetic_cannabinoid"),
+])
+def test_phrases_are_normalised_by_the_tokeniser(kb, text, drug):
+    assert drug in kb.extract_drugs(text)[0]
+
+
+def test_batch_resolution_matches_single_tokens(kb):
+    tokens = ["ketamin", "diazepan", "heroinn", "cocane", "xanax", "ket", "alprazolan"]
+    kb.clear_token_cache()
+    batch = kb.resolve_drug_tokens(tokens + tokens[:2])
+    kb.clear_token_cache()
+    assert list(batch) == tokens
+    assert batch == {token: kb.resolve_drug_token(token) for token in tokens}
+
+
+def test_lexicon_holds_no_drug_terms(fresh_kb):
+    assert fresh_kb.NON_DRUG_WORDS == fresh_kb.NON_DRUG_LEXICON
+    for word in sorted(fresh_kb.NON_DRUG_LEXICON):
+        assert fresh_kb.resolve_drug_token(word).path not in ("exact", "slang", "alias"), word
+
+
+@pytest.mark.parametrize("text, drugs", [
+    ("heroin then nyxoid", ["heroin", "naloxone"]),
+    ("drank 4 cans of beer", ["alcohol"]),
+])
+def test_former_lexicon_terms_resolve(kb, text, drugs):
+    assert kb.extract_drugs(text)[0] == drugs
+
+
+def test_indexed_phrase_rebuilds_the_token_trie(fresh_kb):
+    assert "cannabis" not in fresh_kb.extract_drugs("blue dream")[0]
+    fresh_kb.PHRASE_NORMALISATION["blue dream"] = "cannabis"
+    fresh_kb.index_alias_label("blue dream")
+    assert fresh_kb.extract_drugs("smoked blue dream")[0] == ["cannabis"]
+
+
+def test_longest_phrase_wins(kb):
+    assert kb.extract_drugs("synthetic cannabinoids")[0] == ["generic_synthetic_cannabinoid"]
+    assert kb.extract_drugs("crystal methamphetamine")[0] == ["crystal", "methamphetamine"]
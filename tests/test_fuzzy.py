@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+import triage_core
+
+
+def _queries(labels, n=300, seed=7):
+    """Labels with 0-3 random edits, plus a few labels unchanged."""
+    rnd = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789-"
+    queries = []
+    for _ in range(n):
+        word = list(rnd.choice(labels))
+        for _ in range(rnd.randint(0, 3)):
+            i = rnd.randrange(len(word) + 1)
+            op = rnd.random()
+            if op < 0.4 and i < len(word):
+                word[i] = rnd.choice(alphabet)
+            elif op < 0.7:
+                word.insert(i, rnd.choice(alphabet))
+            elif i < len(word):
+                del word[i]
+        queries.append("".join(word) or "x")
+    return queries
+
+
+@pytest.fixture(scope="module")
+def labels(kb):
+    return sorted(set(kb.BASE_DRUG_CONFIG) | set(kb.DRUG_CONFIG))
+
+
+def _engine(name, labels):
+    if name == "numpy":
+        pytest.importorskip("numpy")
+    return triage_core.FUZZY_ENGINES[name](labels)
+
+
+# Engines checked against the scan; each engine's request adds its own
+ENGINES = ["bktree", "symspell", "numpy", "trigram", "trie", "length"]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("max_distance", [0, 1, 2])
+def test_engine_matches_sorted_label_scan(labels, engine, max_distance):
+    index = _engine(engine, labels)
+    for query in _queries(labels):
+        expected = triage_core.fuzzy_match_drug(query, labels, max_distance)
+        match = index.closest(query, max_distance)
+        assert (match[0] if match else query) == expected, query
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_add_and_discard_match_a_scan(labels, engine):
+    index = _engine(engine, labels)
+    rnd = random.Random(3)
+    live = set(labels)
+    for label in rnd.sample(labels, 100):
+        index.discard(label)
+        live.discard(label)
+    for label in rnd.sample(labels, 30):
+        index.add(label)
+        live.add(label)
+
+    assert len(index) == len(live)
+    remaining = sorted(live)
+    for query in _queries(labels, n=150, seed=11):
+        expected = triage_core.fuzzy_match_drug(query, remaining, 2)
+        match = index.closest(query, 2)
+        assert (match[0] if match else query) == expected, query
+
+
+
+def test_closest_many_matches_closest(labels):
+    pytest.importorskip("numpy")
+    index = triage_core.FUZZY_ENGINES["numpy"](labels)
+    queries = _queries(labels)
+    assert index.closest_many(queries, 2) == [index.closest(q, 2) for q in queries]
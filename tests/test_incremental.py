@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+PIECES = [
+    "took", "2", "x", "20mg", "diazepam", "ketamin", "crystal", "meth", "and",
+    "molly", "5f", "adb", "at", "10pm", "iv", "heroin", "tabs", "£20", "zylofex",
+    "synthetic", "cannabinoids", ",", ".", "\n", " ", "-",
+]
+
+
+def _edit(text, rnd):
+    """Insert a piece or delete a slice at a random position."""
+    pos = rnd.randint(0, len(text))
+    if text and rnd.random() < 0.4:
+        return text[:pos] + text[pos + rnd.randint(1, 6):]
+    piece = rnd.choice(PIECES)
+    if rnd.random() < 0.7:
+        piece = " " + piece + " "
+    return text[:pos] + piece + text[pos:]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_edits_match_full_extraction(fresh_kb, seed):
+    rnd = random.Random(seed)
+    extractor = fresh_kb.IncrementalExtractor()
+    text = "took 2 x 20mg diazepam, then ketamin iv and crystal meth"
+    for _ in range(150):
+        text = _edit(text, rnd)
+        # infer any new tokens first: extract_drugs is only repeatable once
+        # nothing in the text is new to the knowledge base
+        fresh_kb.extract_drugs(text)
+        assert extractor.update(text, with_spans=True) == fresh_kb.extract_drugs(text, with_spans=True), text
+    assert extractor.stats["reused"] > 0
+
+
+def test_inferred_label_retags_split_spellings(fresh_kb):
+    text = "had qyqw xkpam and heroin" + " then cocaine" * 20
+    extractor = fresh_kb.IncrementalExtractor()
+    assert extractor.update(text)[0][:2] == ["qyqw", "xkpam"]
+
+    # a new benzodiazepine-looking name gets a fold key
+    assert fresh_kb.resolve_drug_token("qyqwxkpam").category == "benzodiazepine"
+
+    text += "!"
+    assert extractor.update(text) == fresh_kb.extract_drugs(text)
+    assert extractor.update(text)[0][0] == "qyqwxkpam"
@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+import triage_core
+
+
+def reference_levenshtein(a, b):
+    """Plain Wagner-Fischer DP."""
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def _pairs(seed, max_len):
+    rnd = random.Random(seed)
+    alphabet = "abcde-"
+    for _ in range(150):
+        a = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, max_len)))
+        b = list(a)
+        for _ in range(rnd.randint(0, 6)):
+            i = rnd.randrange(len(b) + 1)
+            if rnd.random() < 0.5 and i < len(b):
+                del b[i]
+            else:
+                b.insert(i, rnd.choice(alphabet))
+        yield a, "".join(b)
+
+
+@pytest.mark.parametrize("max_len", [12, 64, 150])
+def test_levenshtein_matches_reference(max_len):
+    for a, b in _pairs(max_len, max_len):
+        assert triage_core.levenshtein(a, b) == reference_levenshtein(a, b), (a, b)
+
+
+@pytest.mark.parametrize("max_len", [12, 64, 150])
+@pytest.mark.parametrize("k", [0, 1, 2, 5])
+def test_levenshtein_within_is_bounded_reference(max_len, k):
+    for a, b in _pairs(max_len + k, max_len):
+        assert triage_core.levenshtein_within(a, b, k) == min(reference_levenshtein(a, b), k + 1)
+
+
+def test_kernel_boundary_at_64_characters():
+    a = "a" * 64
+    assert triage_core.levenshtein_within(a, a + "b", 1) == 1
+    assert triage_core.levenshtein_within(a + "b", "b" + a, 2) == 2
+    assert triage_core.levenshtein_within("c" + a, a + "c", 1) == 2
@@ -0,0 +1,66 @@
+import pytest
+
+
+@pytest.mark.parametrize("text, kind, value, unit", [
+    ("10am", "time", 10.0, None),
+    ("3pm", "time", 15.0, None),
+    ("12am", "time", 0.0, None),
+    ("10:30pm", "time", 22.5, None),
+    ("22:15", "time", 22.25, None),
+    ("2hrs", "duration", 2.0, "h"),
+    ("30mins", "duration", 30.0, "min"),
+    ("2-3", "count", 3.0, None),
+    ("2-3mg", "dose", 3.0, "mg"),
+    ("1/2", "count", 0.5, None),
+    ("1/4g", "dose", 0.25, "g"),
+    ("20mg/ml", "concentration", 20.0, "mg/ml"),
+    ("£20", "price", 20.0, "gbp"),
+    ("$7.50", "price", 7.5, "usd"),
+])
+def test_single_token_quantities(kb, text, kind, value, unit):
+    quantity, used = kb.classify_quantity(text)
+    assert (quantity.kind, quantity.value, quantity.unit, used) == (kind, value, unit, 1)
+
+
+@pytest.mark.parametrize("token, next_token, kind, value, unit", [
+    ("10", "am", "time", 10.0, None),
+    ("2", "hours", "duration", 2.0, "h"),
+    ("20", "quid", "price", 20.0, "gbp"),
+])
+def test_number_and_unit_word(kb, token, next_token, kind, value, unit):
+    quantity, used = kb.classify_quantity(token, next_token)
+    assert (quantity.kind, quantity.value, quantity.unit, used) == (kind, value, unit, 2)
+
+
+@pytest.mark.parametrize("text", ["13pm", "25:00", "10:75", "1/0"])
+def test_impossible_times_and_fractions_are_not_quantities(kb, text):
+    assert kb.classify_quantity(text) is None
+
+
+@pytest.mark.parametrize("text, drugs", [
+    ("at 10am took ketamine", ["ketamine"]),
+    ("3pm ketamine", ["ketamine"]),
+    ("ketamine for 2hrs, 30mins ago", ["ketamine"]),
+    ("2-3 pills of mdma", ["mdma"]),
+    ("2 - 3 pills of mdma", ["mdma"]),
+    ("1/2 a pill of mdma", ["mdma"]),
+    ("ketamine 20mg/ml", ["ketamine"]),
+    ("£20 of ketamine", ["ketamine"]),
+])
+def test_quantities_are_never_drugs(kb, text, drugs):
+    assert kb.extract_drugs(text) == (drugs, [])
+
+
+def test_x_between_numbers_is_a_times_sign(kb):
+    detected, _, spans = kb.extract_drugs("took 2 x 20mg diazepam", with_spans=True)
+    assert detected == ["diazepam"]
+    assert [(q.kind, q.value, q.unit) for q in spans.quantities[0]] == [
+        ("count", 2.0, "x"), ("dose", 20.0, "mg"),
+    ]
+
+
+def test_new_quantities_attach_to_their_drug(kb):
+    _, _, spans = kb.extract_drugs("£20 of ketamine at 10pm for 2hrs", with_spans=True)
+    assert [(q.kind, q.value) for q in spans.quantities[0]] == [
+        ("price", 20.0), ("time", 22.0), ("duration", 2.0),
+    ]
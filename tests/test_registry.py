@@ -0,0 +1,9 @@
+def test_registry_names_are_suggested(fresh_kb, tmp_path):
+    registry = tmp_path / "registry.csv"
+    registry.write_text("name,class\nzylofentanil,fentanyl analogue\n", encoding="utf-8")
+
+    stats = fresh_kb.ingest_substance_registry(str(registry))
+
+    assert stats["new_names"] == 1
+    assert fresh_kb.get_drug_info("zylofentanil") == ("zylofentanil", "opioid", 5, False)
+    assert fresh_kb.suggest_drugs("zylofentanyl", k=1) == [("zylofentanil", 1, "registry")]
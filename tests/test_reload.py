@@ -0,0 +1,61 @@
+import json
+import shutil
+import time
+
+import pytest
+
+from conftest import KB_PATHS
+
+
+@pytest.fixture
+def kb_files(fresh_kb, tmp_path):
+    """KB_PATHS with drugs.json copied to tmp_path, initialised from there."""
+    paths = dict(KB_PATHS, tripsit_path=str(tmp_path / "drugs.json"))
+    shutil.copy(KB_PATHS["tripsit_path"], paths["tripsit_path"])
+    fresh_kb.initialise_drug_config(**paths)
+    yield paths
+    fresh_kb.stop_reloader()
+
+
+def _add_drug(path, name, category):
+    with open(path, encoding="utf-8") as f:
+        drugs = json.load(f)
+    drugs[name] = {"name": name, "categories": [category], "aliases": [], "properties": {}}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(drugs, f)
+
+
+def test_reload_picks_up_a_new_drug(fresh_kb, kb_files):
+    assert fresh_kb.get_drug_info("zzprofen")[1] == "unknown"
+    fresh_kb.clear_token_cache()
+    _add_drug(kb_files["tripsit_path"], "zzprofen", "stimulant")
+
+    assert fresh_kb.reload_knowledge_base(**kb_files)
+    assert fresh_kb.get_drug_info("zzprofen")[1] == "stimulant"
+    assert not fresh_kb.reload_knowledge_base(**kb_files)  # inputs unchanged
+
+
+def test_malformed_json_keeps_the_old_config(fresh_kb, kb_files):
+    version = fresh_kb.SNAPSHOT_VERSION
+    with open(kb_files["tripsit_path"], "a", encoding="utf-8") as f:
+        f.write("{ not json")
+
+    with pytest.raises(RuntimeError, match="JSONDecodeError"):
+        fresh_kb.reload_knowledge_base(**kb_files)
+    assert fresh_kb.SNAPSHOT_VERSION == version
+    assert fresh_kb.extract_drugs("heroin and xanax")[0] == ["heroin", "alprazolam"]
+
+
+def test_reloader_records_the_child_error(fresh_kb, kb_files):
+    fresh_kb.RELOAD_STATS.pop("error", None)
+    fresh_kb.start_reloader(interval=0.05, **kb_files)
+    time.sleep(0.1)
+    with open(kb_files["tripsit_path"], "a", encoding="utf-8") as f:
+        f.write("{ not json")
+
+    deadline = time.time() + 60
+    while "error" not in fresh_kb.RELOAD_STATS and time.time() < deadline:
+        time.sleep(0.05)
+    error = fresh_kb.RELOAD_STATS["error"]
+    assert "JSONDecodeError" in error
+    assert len(error) < fresh_kb.RELOAD_ERROR_CHARS + 200
@@ -0,0 +1,116 @@
+import hashlib
+import pickle
+import subprocess
+import sys
+
+from conftest import KB_PATHS, ROOT
+
+TEXTS = [
+    "heroin and xanax with 4 cans",
+    "ket, 2 tabs and some 5f adb",
+    "mdma x2 and alcohol then diazepan",
+    "found unresponsive after methadone and pregabalin",
+]
+
+
+def _state(kb):
+    return (
+        {name: dict(info) for name, info in kb.DRUG_CONFIG.items()},
+        dict(kb.NORMALISATION_MAP),
+        set(kb.NON_DRUG_WORDS),
+        dict(kb.TRIPSIT_COMBO_PENALTIES),
+        [kb.extract_drugs(text) for text in TEXTS],
+    )
+
+
+def test_snapshot_round_trip(fresh_kb, tmp_path):
+    path = str(tmp_path / "kb.snapshot")
+
+    fresh_kb.initialise_drug_config(**KB_PATHS, snapshot_path=path)
+    assert not fresh_kb.SNAPSHOT_STATS["loaded"]
+    built = _state(fresh_kb)
+
+    fresh_kb.initialise_drug_config(**KB_PATHS, snapshot_path=path)
+    assert fresh_kb.SNAPSHOT_STATS["loaded"]
+    assert _state(fresh_kb) == built
+
+
+def test_corrupt_snapshot_is_rebuilt(fresh_kb, tmp_path):
+    path = tmp_path / "kb.snapshot"
+    path.write_bytes(b"\x80\x04\x95not a pickle")
+
+    fresh_kb.initialise_drug_config(**KB_PATHS, snapshot_path=str(path))
+
+    assert not fresh_kb.SNAPSHOT_STATS["loaded"]
+    assert fresh_kb.extract_drugs("heroin") == (["heroin"], [])
+    fresh_kb.initialise_drug_config(**KB_PATHS, snapshot_path=str(path))
+    assert fresh_kb.SNAPSHOT_STATS["loaded"]
+
+
+_WORKER = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import triage_core
+triage_core.start_warmup(
+    tripsit_path=sys.argv[2], lexicon_path=sys.argv[3], combos_path=sys.argv[4],
+    snapshot_path=sys.argv[5],
+)
+triage_core.ensure_ready(60)
+print(triage_core.triage_from_text_and_context("heroin and xanax", {})["detected_drugs"])
+"""
+
+
+def test_concurrent_workers_share_one_snapshot_path(tmp_path):
+    path = str(tmp_path / "kb.snapshot")
+    args = [sys.executable, "-c", _WORKER, ROOT, KB_PATHS["tripsit_path"],
+            KB_PATHS["lexicon_path"], KB_PATHS["combos_path"], path]
+    workers = [
+        subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        for _ in range(6)
+    ]
+    results = [worker.communicate(timeout=120) for worker in workers]
+
+    for worker, (out, err) in zip(workers, results):
+        assert worker.returncode == 0, err
+        assert out.strip() == "['heroin', 'alprazolam']"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["kb.snapshot"]
+
+
+class _Marker:
+    """Unpickling this creates a file: stands in for a hostile payload."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return open, (self.path, "w")
+
+
+def _write_snapshot(kb, path, payload, digest=None, payload_hash=None):
+    digest = digest or kb.knowledge_snapshot_hash(**KB_PATHS)
+    payload_hash = payload_hash or hashlib.sha256(payload).hexdigest()
+    header = f"triage-kb {kb.SNAPSHOT_FORMAT} {digest} {payload_hash}\n".encode()
+    path.write_bytes(header + payload)
+
+
+def test_header_is_checked_before_unpickling(kb, tmp_path):
+    marker = tmp_path / "unpickled"
+    payload = pickle.dumps(_Marker(str(marker)))
+    path = tmp_path / "kb.snapshot"
+    digest = kb.knowledge_snapshot_hash(**KB_PATHS)
+
+    _write_snapshot(kb, path, payload, digest="0" * 64)
+    assert not kb.load_knowledge_snapshot(str(path), digest)
+    _write_snapshot(kb, path, payload, payload_hash="0" * 64)
+    assert not kb.load_knowledge_snapshot(str(path), digest)
+    path.write_bytes(payload)
+    assert not kb.load_knowledge_snapshot(str(path), digest)
+    assert not marker.exists()
+
+
+def test_unpickling_error_is_a_miss(kb, tmp_path):
+    path = tmp_path / "kb.snapshot"
+    digest = kb.knowledge_snapshot_hash(**KB_PATHS)
+    for payload in (b"\x80\x04\x95not a pickle", pickle.dumps(["not", "a", "snapshot"])):
+        _write_snapshot(kb, path, payload)
+        assert not kb.load_knowledge_snapshot(str(path), digest)
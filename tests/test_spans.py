@@ -0,0 +1,25 @@
+TEXT = "Took 2x 20mg diazepam, then ketamin IV and Crystal  Meth; molly 5F–ADB."
+
+
+def test_span_table(kb):
+    detected, unknowns, spans = kb.extract_drugs(TEXT, with_spans=True)
+
+    assert spans.canonical == detected == ["diazepam", "ketamine", "methamphetamine", "mdma", "5f-adb"]
+    assert spans.path == ["exact", "fuzzy", "alias", "slang", "folded"]
+    assert spans.surface == ["diazepam", "ketamin", "Crystal  Meth", "molly", "5F–ADB"]
+    assert list(zip(spans.start, spans.end)) == [(13, 21), (28, 35), (43, 56), (58, 63), (64, 70)]
+    for start, end, surface in zip(spans.start, spans.end, spans.surface):
+        assert TEXT[start:end] == surface
+    assert [[q.surface for q in qs] for qs in spans.quantities] == [["2x", "20mg"], ["iv"], [], [], []]
+
+
+def test_multi_token_key_spans_every_token(kb):
+    text = "had some mdmb 4en pinaca"
+    _, _, spans = kb.extract_drugs(text, with_spans=True)
+    assert spans.canonical == ["mdmb-4en-pinaca"]
+    assert text[spans.start[0]:spans.end[0]] == "mdmb 4en pinaca"
+
+
+def test_chunked_input_gives_the_same_spans(kb):
+    chunks = [TEXT[i:i + 5] for i in range(0, len(TEXT), 5)]
+    assert kb.extract_drugs(chunks, with_spans=True) == kb.extract_drugs(TEXT, with_spans=True)
@@ -0,0 +1,46 @@
+import pytest
+
+from test_fuzzy import _queries
+
+
+@pytest.fixture(scope="module")
+def suggest_labels(kb):
+    kb.rebuild_suggest_index()
+    return sorted(kb.SUGGEST_INDEX.labels)
+
+
+def test_suggestions_are_closest_first_and_unique(kb):
+    suggestions = kb.suggest_drugs("ketamin", k=3)
+    assert suggestions[0] == ("ketamine", 1, "base")
+    assert len(suggestions) == 3
+    distances = [dist for _, dist, _ in suggestions]
+    assert distances == sorted(distances)
+    assert len({name for name, _, _ in suggestions}) == 3
+
+
+def test_slang_is_suggested_under_its_canonical_name(kb):
+    assert kb.suggest_drugs("molly", k=1) == [("mdma", 0, "slang")]
+
+
+def test_max_distance_drops_far_labels(kb):
+    assert kb.suggest_drugs(" Ketamin ", k=3, max_distance=1) == [("ketamine", 1, "base")]
+    assert kb.suggest_drugs("herion", k=3, max_distance=1) == []
+    assert kb.suggest_drugs("zzzzqqq", max_distance=2) == []
+
+
+def test_best_suggestion_matches_a_full_scan(kb, suggest_labels):
+    for query in _queries(suggest_labels, n=200, seed=5):
+        best = min(kb.levenshtein(query, label) for label in suggest_labels)
+        suggestions = kb.suggest_drugs(query, k=1, max_distance=2)
+        if best > 2:
+            assert suggestions == [], query
+        else:
+            assert suggestions[0][1] == best, query
+
+
+def test_max_distance_lists_every_drug_within_it(kb, suggest_labels):
+    for query in _queries(suggest_labels, n=100, seed=9):
+        names = {kb._label_source(label)[0]
+                 for label in suggest_labels if kb.levenshtein(query, label) <= 1}
+        suggestions = kb.suggest_drugs(query, k=len(suggest_labels), max_distance=1)
+        assert {name for name, _, _ in suggestions} == names, query
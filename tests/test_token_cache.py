@@ -0,0 +1,48 @@
+def test_repeat_lookup_is_a_cache_hit(fresh_kb):
+    fresh_kb.clear_token_cache()
+    first = fresh_kb.resolve_drug_token("ketamin")
+    assert fresh_kb.resolve_drug_token("ketamin") is first
+    info = fresh_kb.token_cache_info()
+    assert (info["hits"], info["misses"]) == (1, 1)
+
+
+def test_config_version_bump_invalidates(fresh_kb):
+    fresh_kb.clear_token_cache()
+    assert fresh_kb.get_drug_info("ketamine")[2] == 3
+    fresh_kb.DRUG_CONFIG["ketamine"]["score"] = 9
+    assert fresh_kb.get_drug_info("ketamine")[2] == 3  # still cached
+    fresh_kb.bump_config_version()
+    assert fresh_kb.get_drug_info("ketamine")[2] == 9
+
+
+def test_new_label_invalidates_corrections_only(fresh_kb):
+    fresh_kb.clear_token_cache()
+    assert fresh_kb.resolve_drug_token("ketaminx").canonical == "ketamine"
+    exact = fresh_kb.resolve_drug_token("heroin")
+
+    fresh_kb.DRUG_CONFIG["ketaminx"] = {"category": "dissociative", "score": 3}
+    fresh_kb.index_drug_label("ketaminx")
+
+    assert fresh_kb.resolve_drug_token("ketaminx").canonical == "ketaminx"
+    assert fresh_kb.resolve_drug_token("heroin") is exact
+
+
+def test_tagging_version_rebuilds_the_trie_but_keeps_resolutions(fresh_kb, monkeypatch):
+    fresh_kb.clear_token_cache()
+    trie = fresh_kb.get_token_trie()
+    cached = fresh_kb.resolve_drug_token("ketamin")
+
+    monkeypatch.setattr(fresh_kb, "TAGGING_VERSION", fresh_kb.TAGGING_VERSION + 1)
+
+    assert fresh_kb.get_token_trie() is not trie
+    assert fresh_kb.resolve_drug_token("ketamin") is cached
+
+
+def test_cache_is_lru_bounded(fresh_kb, monkeypatch):
+    fresh_kb.clear_token_cache()
+    monkeypatch.setattr(fresh_kb, "TOKEN_CACHE_MAXSIZE", 3)
+    for token in ("heroin", "ketamine", "cocaine", "heroin", "diazepam"):
+        fresh_kb.resolve_drug_token(token)
+
+    assert list(fresh_kb.TOKEN_CACHE) == ["cocaine", "heroin", "diazepam"]
+    assert fresh_kb.token_cache_info()["evictions"] == 1
@@ -0,0 +1,36 @@
+import io
+import random
+
+import pytest
+
+NOTE = (
+    "Client reports 2x 20mg diazepam, then 1.5g ket + 'molly' (5F–ADB?) "
+    "at 10pm; crystal meth & synthetic cannabinoids,\nsmoked/snorted. "
+)
+
+
+def _chunks(text, rnd):
+    cuts = sorted(rnd.sample(range(1, len(text)), rnd.randint(1, 40)))
+    return [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_chunked_tokens_match_whole_text(kb, seed):
+    rnd = random.Random(seed)
+    text = NOTE * rnd.randint(1, 5)
+    expected = list(kb.iter_tokens(text))
+
+    assert list(kb.iter_tokens(_chunks(text, rnd))) == expected
+    assert list(kb.iter_tokens(io.StringIO(text), chunk_size=rnd.randint(1, 17))) == expected
+    for token, start, end in expected:
+        assert text[start:end].lower() == token
+
+
+def test_one_character_chunks(kb):
+    assert list(kb.iter_tokens(iter(NOTE))) == list(kb.iter_tokens(NOTE))
+
+
+def test_chunked_segments_match_whole_text(kb):
+    rnd = random.Random(1)
+    text = NOTE * 3
+    assert list(kb.iter_segments(_chunks(text, rnd))) == list(kb.iter_segments(text))
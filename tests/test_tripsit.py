@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from conftest import KB_PATHS
+
+
+def _write_drugs(tmp_path, data):
+    path = tmp_path / "drugs.json"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return str(path)
+
+
+def test_nameless_entries_are_skipped_one_by_one(kb, tmp_path):
+    with open(KB_PATHS["tripsit_path"], encoding="utf-8") as f:
+        data = json.load(f)
+    first, second, third = list(data)[:3]
+    del data[first]["name"]
+    data[second] = "not an entry"
+
+    drugs = kb.read_tripsit_drugs(_write_drugs(tmp_path, data))
+
+    assert first not in drugs and second not in drugs and third in drugs
+    assert len(drugs) == len(data) - 2
+    assert kb.TRIPSIT_LOAD_STATS["skipped"] == 2
+
+
+def test_file_without_drug_entries_is_an_error(kb, tmp_path):
+    path = _write_drugs(tmp_path, {"ket": {"pretty_name": "Ketamine"}})
+    with pytest.raises(ValueError):
+        kb.read_tripsit_drugs(path)
+
+
+UPDATE_TEXTS = [
+    "zzdrug and zz street mix with heroin",
+    "molly, mandy and 2c-b",
+    "1b-lsd then mdma and ketamine",
+    "diazepam with 1,4-butanediol",
+]
+
+
+def _kb_state(kb):
+    return {
+        "drug_config": {name: dict(info) for name, info in kb.DRUG_CONFIG.items()},
+        "tripsit_names": set(kb.TRIPSIT_DRUG_NAMES),
+        "normalisation": dict(kb.NORMALISATION_MAP),
+        "phrases": dict(kb.PHRASE_NORMALISATION),
+        "non_drug_words": set(kb.NON_DRUG_WORDS),
+        "penalties": dict(kb.TRIPSIT_COMBO_PENALTIES),
+        "combo_labels": set(kb.TRIPSIT_COMBO_LABELS),
+        "fold_index": dict(kb.FOLD_INDEX),
+        "suggest": set(kb.SUGGEST_INDEX.ids),
+        "fuzzy_labels": len(kb.FUZZY_INDEX),
+        "extracted": [kb.extract_drugs(text) for text in UPDATE_TEXTS],
+    }
+
+
+def test_apply_tripsit_update_matches_a_fresh_load(fresh_kb, tmp_path):
+    with open(KB_PATHS["tripsit_path"], encoding="utf-8") as f:
+        drugs = json.load(f)
+    with open(KB_PATHS["combos_path"], encoding="utf-8") as f:
+        combos = json.load(f)
+
+    for name in ("1b-lsd", "2-ai", "1,4-butanediol"):
+        del drugs[name]
+    drugs["zzdrug"] = {
+        "name": "zzdrug", "categories": ["opioid"], "aliases": ["zzd", "zz street"],
+    }
+    drugs["mdma"]["categories"] = ["depressant"]
+    drugs["mdma"]["aliases"] = ["molly", "zz street mix"]
+    first, second = list(combos)[:2]
+    del combos[first]
+    combos[second] = {name: {"status": "Dangerous"} for name in combos[second]}
+    combos["zzdrug"] = {"heroin": {"status": "Dangerous"}}
+
+    new_drugs = _write_drugs(tmp_path, drugs)
+    new_combos = tmp_path / "combos.json"
+    new_combos.write_text(json.dumps(combos), encoding="utf-8")
+
+    fresh_kb.initialise_drug_config(**KB_PATHS)
+    report = fresh_kb.apply_tripsit_update(
+        KB_PATHS["tripsit_path"], new_drugs, KB_PATHS["combos_path"], str(new_combos)
+    )
+    updated = _kb_state(fresh_kb)
+
+    fresh_kb.initialise_drug_config(
+        tripsit_path=new_drugs, lexicon_path=KB_PATHS["lexicon_path"],
+        combos_path=str(new_combos),
+    )
+    assert report["drugs_added"] == ["zzdrug"] and report["drugs_removed"]
+    assert updated == _kb_state(fresh_kb)
@@ -0,0 +1,30 @@
+import shutil
+import threading
+
+import pytest
+
+from conftest import KB_PATHS
+
+
+def test_failed_warmup_is_retried(fresh_kb, tmp_path, monkeypatch):
+    tripsit = tmp_path / "drugs.json"
+    runs = []
+    warmup = fresh_kb._warmup
+    monkeypatch.setattr(fresh_kb, "_warmup", lambda kwargs: (runs.append(1), warmup(kwargs)))
+
+    fresh_kb.start_warmup(**dict(KB_PATHS, tripsit_path=str(tripsit)))
+    with pytest.raises(RuntimeError):
+        fresh_kb.ensure_ready(60)
+    assert not fresh_kb.is_ready()
+    assert fresh_kb.WARMUP_STATS["ok"] is False
+
+    shutil.copy(KB_PATHS["tripsit_path"], tripsit)
+    callers = [threading.Thread(target=fresh_kb.ensure_ready, args=(60,)) for _ in range(8)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+
+    assert len(runs) == 2  # one retry, however many callers saw the failure
+    assert fresh_kb.is_ready()
+    assert fresh_kb.extract_drugs("heroin and xanax")[0] == ["heroin", "alprazolam"]
@@ -8,29 +8,130 @@ Original file is located at
 """
 
 import re
+import sys
+import csv
 import json
-from typing import Dict, List, Tuple, Optional
+import os
+import pickle
+import hashlib
+import threading
+import subprocess
+import tempfile
+import time
+import bisect
+import unicodedata
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # optional: only the "numpy" fuzzy engine needs it
+    np = None
+
+# Longest pattern handled by the bit-parallel kernel (one machine word)
+_MYERS_MAX_LEN = 64
+
+
+@lru_cache(maxsize=2048)
+def _myers_peq(pattern: str) -> Dict[str, int]:
+    """Per-character match bitmasks for the bit-parallel kernel."""
+    peq: Dict[str, int] = {}
+    for i, c in enumerate(pattern):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    return peq
+
+
+def _myers_within(pattern: str, text: str, k: int) -> int:
+    """
+    Myers/Hyyrö bit-parallel edit distance (len(pattern) <= 64).
+    Tracks D[m][j] one text character at a time and stops as soon as the
+    remaining characters can no longer bring it back under k.
+    """
+    m = len(pattern)
+    n = len(text)
+    peq = _myers_peq(pattern)
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+
+    pv = mask
+    mv = 0
+    score = m
+    for j, c in enumerate(text):
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        # each further column moves the score by at most one
+        if score - (n - j - 1) > k:
+            return k + 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    return score if score <= k else k + 1
+
+
+def _banded_within(a: str, b: str, k: int) -> int:
+    """Ukkonen banded DP: only cells with |i - j| <= k, early exit on row minimum."""
+    n = len(b)
+    big = k + 1
+    previous = [j if j <= k else big for j in range(n + 1)]
+    for i in range(1, len(a) + 1):
+        c1 = a[i - 1]
+        lo = max(1, i - k)
+        hi = min(n, i + k)
+        current = [big] * (n + 1)
+        current[0] = i if i <= k else big
+        row_min = current[0]
+        for j in range(lo, hi + 1):
+            cost = previous[j - 1] + (c1 != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            if cost > big:
+                cost = big
+            current[j] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > k:
+            return big
+        previous = current
+    return min(previous[n], big)
 
-# Simple Levenshtein distance (edit distance)
-def levenshtein(a: str, b: str) -> int:
+
+def levenshtein_within(a: str, b: str, k: int) -> int:
+    """
+    Bounded edit distance: returns levenshtein(a, b) if it is <= k,
+    otherwise k + 1. Uses the bit-parallel kernel when the shorter string
+    fits in 64 characters and a banded DP otherwise.
+    """
     if a == b:
         return 0
-    if len(a) < len(b):
-        return levenshtein(b, a)
-    if len(b) == 0:
-        return len(a)
-    previous = range(len(b) + 1)
-    for i, c1 in enumerate(a):
-        current = [i + 1]
-        for j, c2 in enumerate(b):
-            insertions = previous[j + 1] + 1
-            deletions = current[j] + 1
-            substitutions = previous[j] + (c1 != c2)
-            current.append(min(insertions, deletions, substitutions))
-        previous = current
-    return previous[-1]
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) - len(a) > k:
+        return k + 1
+    if len(a) == 0:
+        return len(b)
+    if len(a) <= _MYERS_MAX_LEN:
+        return _myers_within(a, b, k)
+    return _banded_within(a, b, k)
+
+
+# Levenshtein distance (edit distance)
+def levenshtein(a: str, b: str) -> int:
+    return levenshtein_within(a, b, max(len(a), len(b)))
 
-# If you later use EMCDDA/NPS Discovery, you can also import pandas
+# EMCDDA / NPS Discovery-style registries (CSV or JSON lines) are streamed
+# by ingest_substance_registry (section 2e), so no pandas is needed
 
 # =============================================================================
 # 1. CATEGORY DEFAULTS AND BASE DRUG SET (YOUR BRISTOL / CORE DATASET)
@@ -117,6 +218,9 @@ SLANG_MAP: Dict[str, str] = {
 
     # OPIOID SYRUP SLANG
     "lean": "codeine",
+
+    # Naloxone nasal spray
+    "nyxoid": "naloxone",
 }
 
 
@@ -215,6 +319,7 @@ BASE_DRUG_CONFIG: Dict[str, Dict[str, object]] = {
     "noscapine":       {"category": "other", "score": 1},
     "papaverine":      {"category": "other", "score": 1},
     "paracetamol":     {"category": "other", "score": 1},
+    "naloxone":        {"category": "other", "score": 1},
     "sl-164":          {"category": "other", "score": 2},
     "cannabis":        {"category": "other", "score": 1},
     "weed":            {"category": "other", "score": 1},
@@ -227,6 +332,9 @@ BASE_DRUG_CONFIG: Dict[str, Dict[str, object]] = {
 # Global config (will be populated by initialise_drug_config)
 DRUG_CONFIG: Dict[str, Dict[str, object]] = {}
 
+# Names that came from TripSit drugs.json (used to attribute suggestions)
+TRIPSIT_DRUG_NAMES: Set[str] = set()
+
 # =============================================================================
 # 2. TRIPSIT: DRUGS.JSON INGESTION
 # =============================================================================
@@ -265,6 +373,17 @@ def ingest_drug_record(name: str, internal_cat: str, default_score: int) -> None
     if not name:
         return
 
+    if _merge_drug_record(name, internal_cat, default_score):
+        index_drug_label(name)
+
+    bump_config_version()
+
+
+def _merge_drug_record(name: str, internal_cat: str, default_score: int) -> bool:
+    """
+    ingest_drug_record's merge into DRUG_CONFIG (name already normalised),
+    without indexing. Returns True if name is new.
+    """
     if internal_cat not in CATEGORY_DEFAULT_SCORE:
         internal_cat = "other"
 
@@ -277,122 +396,1171 @@ def ingest_drug_record(name: str, internal_cat: str, default_score: int) -> None
         # update category UNLESS existing one is more specific
         if existing["category"] == "unknown" and internal_cat != "unknown":
             existing["category"] = internal_cat
+        return False
 
-    else:
-        DRUG_CONFIG[name] = {
-            "category": internal_cat,
-            "score": default_score,
-        }
+    DRUG_CONFIG[name] = {
+        "category": internal_cat,
+        "score": default_score,
+    }
+    return True
+
+
+# drugs.json fields used by load_tripsit_drugs and build_alias_maps_from_tripsit
+_TRIPSIT_FIELDS = ("categories", "aliases", "properties")
+
+# Stats of the last read_tripsit_drugs call
+TRIPSIT_LOAD_STATS: Dict[str, object] = {}
+
+
+class _TripsitEntry(dict):
+    """A drugs.json object with a "name", trimmed to _TRIPSIT_FIELDS."""
 
 
-def load_tripsit_drugs(json_path: str) -> None:
+def _tripsit_object_hook(pairs: List[Tuple[str, object]]) -> dict:
     """
-    Load TripSit drugs.json and add entries to DRUG_CONFIG.
+    json object_pairs_hook for drugs.json that keeps only what ingestion
+    uses, so summaries, dose tables, effects and links are dropped as soon
+    as they are parsed. A drug entry (an object with a "name") becomes a
+    _TripsitEntry with categories, aliases and properties; any other object
+    keeps its keys but only its object values and common_names (other
+    values become None), so read_tripsit_drugs can tell the top level's
+    entries from malformed ones.
     """
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    obj = dict(pairs)
+    if "name" in obj:
+        return _TripsitEntry(
+            (key, obj[key]) for key in _TRIPSIT_FIELDS if obj.get(key) is not None
+        )
+    return {
+        key: value if isinstance(value, dict) or key == "common_names" else None
+        for key, value in obj.items()
+    }
 
-    for drug_name, meta in data.items():
-        cats = meta.get("categories") or []
-        if isinstance(cats, str):
-            cats = [cats]
-
-        # Prefer pharmacological tags
-        preferred_order = [
-            "opioid",
-            "benzodiazepine",
-            "benzo",
-            "stimulant",
-            "empathogen",
-            "psychedelic",
-            "hallucinogen",
-            "dissociative",
-            "depressant",
-            "barbiturate",
-        ]
 
-        lc_cats = [c.lower() for c in cats]
-        ext_cat_main = ""
-        for pref in preferred_order:
-            for c in lc_cats:
-                if pref in c:
-                    ext_cat_main = c
-                    break
-            if ext_cat_main:
-                break
+def read_tripsit_drugs(json_path: str, trace_memory: bool = False) -> Dict[str, dict]:
+    """
+    Parse TripSit drugs.json in one pass into {name: entry}, where entry
+    holds only categories, aliases and properties.common_names. Top-level
+    values that are not drug objects (no "name") are skipped and counted;
+    raises ValueError if the file has entries but none of them load.
+    Records load time in TRIPSIT_LOAD_STATS, and peak traced memory when
+    trace_memory is set (tracemalloc slows the parse down noticeably).
+    """
+    if trace_memory:
+        import tracemalloc
 
-        if not ext_cat_main and lc_cats:
-            ext_cat_main = lc_cats[0]
+        was_tracing = tracemalloc.is_tracing()
+        if was_tracing:
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+
+    t0 = time.perf_counter()
+    with open(json_path, "r", encoding="utf-8") as f:
+        top = json.load(f, object_pairs_hook=_tripsit_object_hook)
+    if not isinstance(top, dict) or isinstance(top, _TripsitEntry):
+        raise ValueError(f"{json_path} is not a TripSit name -> drug object")
+    data: Dict[str, dict] = {}
+    skipped = 0
+    for name, entry in top.items():
+        if isinstance(entry, _TripsitEntry):
+            data[name] = dict(entry)
+        else:
+            skipped += 1
+    seconds = time.perf_counter() - t0
+
+    peak_bytes = None
+    if trace_memory:
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        if not was_tracing:
+            tracemalloc.stop()
+
+    if top and not data:
+        raise ValueError(f"No drug entries in {json_path} ({skipped} skipped)")
+
+    TRIPSIT_LOAD_STATS.clear()
+    TRIPSIT_LOAD_STATS.update({
+        "path": json_path,
+        "drugs": len(data),
+        "skipped": skipped,
+        "load_seconds": seconds,
+        "peak_bytes": peak_bytes,
+    })
+    return data
+
+
+def load_tripsit_drugs(json_path: str, data: Optional[Dict[str, dict]] = None) -> None:
+    """
+    Load TripSit drugs.json and add entries to DRUG_CONFIG.
+    data is read_tripsit_drugs(json_path), if the caller already has it.
+    """
+    if data is None:
+        data = read_tripsit_drugs(json_path)
 
-        internal_cat = map_tripsit_category_to_internal(ext_cat_main)
+    for drug_name, meta in data.items():
+        internal_cat = _tripsit_internal_category(meta)
         default_score = CATEGORY_DEFAULT_SCORE.get(internal_cat, 2)
 
         ingest_drug_record(drug_name, internal_cat, default_score)
+        TRIPSIT_DRUG_NAMES.add(drug_name.lower().strip())
+
+
+def _tripsit_internal_category(meta: dict) -> str:
+    """Internal category for a drugs.json entry, from its main TripSit category."""
+    cats = meta.get("categories") or []
+    if isinstance(cats, str):
+        cats = [cats]
+
+    # Prefer pharmacological tags
+    preferred_order = [
+        "opioid",
+        "benzodiazepine",
+        "benzo",
+        "stimulant",
+        "empathogen",
+        "psychedelic",
+        "hallucinogen",
+        "dissociative",
+        "depressant",
+        "barbiturate",
+    ]
+
+    lc_cats = [c.lower() for c in cats]
+    ext_cat_main = ""
+    for pref in preferred_order:
+        for c in lc_cats:
+            if pref in c:
+                ext_cat_main = c
+                break
+        if ext_cat_main:
+            break
+
+    if not ext_cat_main and lc_cats:
+        ext_cat_main = lc_cats[0]
 
-def build_alias_maps_from_tripsit(json_path: str) -> None:
+    return map_tripsit_category_to_internal(ext_cat_main)
+
+def build_alias_maps_from_tripsit(json_path: str, data: Optional[Dict[str, dict]] = None) -> None:
     """
     Read TripSit's drugs.json and extend:
       - NORMALISATION_MAP with single-word aliases
       - PHRASE_NORMALISATION with multi-word aliases (e.g. 'crystal meth').
     Canonical name = the main key in drugs.json.
+    data is read_tripsit_drugs(json_path), if the caller already has it.
     """
     global NORMALISATION_MAP, PHRASE_NORMALISATION
 
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    if data is None:
+        data = read_tripsit_drugs(json_path)
 
     for canonical, meta in data.items():
         canon = canonical.lower().strip()
 
-        # 1) Collect aliases: TripSit usually stores them under 'aliases'
-        aliases = meta.get("aliases") or []
-
-        # 2) Optionally also include 'common_names' under properties, if present
-        props = meta.get("properties") or {}
-        common_names = props.get("common_names") or []
-        if isinstance(common_names, str):
-            common_names = [common_names]
-
-        for raw in list(aliases) + list(common_names):
-            if not raw:
-                continue
-            alias = raw.lower().strip()
-
-            # simple cleanup: normalise spaces & hyphens
-            alias = alias.replace("–", "-")
-            alias = alias.replace("_", " ")
-
-            # skip if alias is identical to canonical
-            if alias == canon:
-                continue
-
+        for alias in _tripsit_aliases(canon, meta):
             # Multi-word aliases → phrase normalisation (e.g. "crystal meth")
             if " " in alias:
                 # we don't want to clobber your manual entries if already set
                 if alias not in PHRASE_NORMALISATION:
                     PHRASE_NORMALISATION[alias] = canon
+                else:
+                    continue
             else:
                 # Single word → normalisation map
                 if alias not in NORMALISATION_MAP:
                     NORMALISATION_MAP[alias] = canon
+                else:
+                    continue
 
+            index_alias_label(alias)
+            bump_config_version()
 
-def initialise_drug_config(tripsit_path: Optional[str] = None) -> None:
+
+def _tripsit_aliases(canon: str, meta: dict) -> List[str]:
+    """Cleaned aliases and common names of a drugs.json entry, except canon itself."""
+    # 1) Collect aliases: TripSit usually stores them under 'aliases'
+    aliases = meta.get("aliases") or []
+
+    # 2) Optionally also include 'common_names' under properties, if present
+    props = meta.get("properties") or {}
+    common_names = props.get("common_names") or []
+    if isinstance(common_names, str):
+        common_names = [common_names]
+
+    out = []
+    for raw in list(aliases) + list(common_names):
+        if not raw:
+            continue
+        alias = raw.lower().strip()
+
+        # simple cleanup: normalise spaces & hyphens
+        alias = alias.replace("–", "-")
+        alias = alias.replace("_", " ")
+
+        # skip if alias is identical to canonical
+        if alias == canon:
+            continue
+        out.append(alias)
+    return out
+
+
+def initialise_drug_config(
+    tripsit_path: Optional[str] = None,
+    fuzzy_engine: Optional[str] = None,
+    distance_budget: Optional[List[Tuple[int, int]]] = None,
+    lexicon_path: Optional[str] = None,
+    combos_path: Optional[str] = None,
+    snapshot_path: Optional[str] = None,
+) -> None:
     """
     Populate DRUG_CONFIG with:
       1. BASE_DRUG_CONFIG
       2. TripSit drugs.json
       3. TripSit alias maps (critical)
+    load the non-drug word list (lexicon_path, e.g. non_drug_words.txt)
+    and TripSit combos (combos_path, see load_tripsit_combos), and build
+    the fuzzy index. drugs.json is parsed once (see read_tripsit_drugs;
+    load time in TRIPSIT_LOAD_STATS). fuzzy_engine selects one of
+    FUZZY_ENGINES (default: keep the current FUZZY_ENGINE); build time and
+    approximate memory are reported in FUZZY_INDEX_STATS. distance_budget
+    replaces FUZZY_DISTANCE_BUDGET (pass [] for a flat FUZZY_MAX_DISTANCE).
+
+    With snapshot_path, all of the above is loaded from that knowledge
+    snapshot if it was built from the same inputs, and otherwise built as
+    usual and written there (see save_knowledge_snapshot).
+
+    Runs under the KB_LOCK write lock; SNAPSHOT_VERSION identifies the
+    inputs of the resulting config.
     """
-    global DRUG_CONFIG
-    DRUG_CONFIG = dict(BASE_DRUG_CONFIG)
+    global FUZZY_ENGINE, FUZZY_DISTANCE_BUDGET, SNAPSHOT_VERSION
+    if fuzzy_engine is not None and fuzzy_engine not in FUZZY_ENGINES:
+        raise ValueError(
+            f"Unknown fuzzy engine {fuzzy_engine!r}; "
+            f"expected one of {sorted(FUZZY_ENGINES)}"
+        )
+
+    # in-flight triages finish on the old config first (see KB_LOCK)
+    with KB_LOCK.write():
+        if distance_budget is not None:
+            FUZZY_DISTANCE_BUDGET = list(distance_budget)
+        if fuzzy_engine is not None:
+            FUZZY_ENGINE = fuzzy_engine
+
+        digest = knowledge_snapshot_hash(tripsit_path, combos_path, lexicon_path)
+
+        REGISTRY_SOURCES.clear()
+        REGISTRY_DRUG_NAMES.clear()
+        if not (snapshot_path and load_knowledge_snapshot(snapshot_path, digest)):
+            _build_drug_config(tripsit_path, lexicon_path, combos_path)
+            if snapshot_path:
+                save_knowledge_snapshot(snapshot_path, digest)
+
+        SNAPSHOT_VERSION = digest[:12]
+
+
+def _build_drug_config(
+    tripsit_path: Optional[str], lexicon_path: Optional[str], combos_path: Optional[str]
+) -> None:
+    """The from-source part of initialise_drug_config."""
+    global DRUG_CONFIG, NORMALISATION_MAP, PHRASE_NORMALISATION
+
+    # per-entry copies: ingest_drug_record updates entries in place
+    DRUG_CONFIG = {name: dict(info) for name, info in BASE_DRUG_CONFIG.items()}
+    TRIPSIT_DRUG_NAMES.clear()
+    NORMALISATION_MAP = dict(_PRISTINE_NORMALISATION_MAP)
+    PHRASE_NORMALISATION = dict(_PRISTINE_PHRASE_NORMALISATION)
 
     if tripsit_path:
+        # One pass over drugs.json, keeping only the fields used below
+        tripsit_data = read_tripsit_drugs(tripsit_path)
+
         # Load main drug list
-        load_tripsit_drugs(tripsit_path)
+        load_tripsit_drugs(tripsit_path, tripsit_data)
 
         # ALSO load all aliases (THIS WAS MISSING)
-        build_alias_maps_from_tripsit(tripsit_path)
+        build_alias_maps_from_tripsit(tripsit_path, tripsit_data)
+
+    # Non-drug vocabulary, filtered against the labels/aliases loaded above
+    if lexicon_path:
+        load_non_drug_lexicon(lexicon_path)
+
+    # Fuzzy index over every known label (base + TripSit);
+    # this also invalidates cached token resolutions
+    rebuild_fuzzy_index()
+
+    # Trigram index behind suggest_drugs()
+    rebuild_suggest_index()
+
+    # Phonetic keys for street spellings ("ketamean", "zanax")
+    rebuild_phonetic_index()
+
+    # Folded keys for "5F–ADB", "5f adb", "5f_mdmb_pinaca"
+    rebuild_fold_index()
+
+    if combos_path:
+        load_tripsit_combos(combos_path)
+
+
+# =============================================================================
+# 2a. KNOWLEDGE SNAPSHOT (precompiled initialise_drug_config output)
+# =============================================================================
+
+# Bump when the snapshot layout changes
+SNAPSHOT_FORMAT = 3
+
+# First line of a snapshot: b"triage-kb <format> <digest> <payload sha256>\n".
+# It is checked before the pickle that follows is read.
+_SNAPSHOT_MAGIC = b"triage-kb"
+_SNAPSHOT_KEYS = frozenset({
+    "drug_config", "tripsit_drug_names", "normalisation_map", "phrase_normalisation",
+    "non_drug_words", "non_drug_lexicon", "combo_penalties", "combo_labels",
+    "fuzzy_index", "fuzzy_index_stats", "suggest_index", "phonetic_index",
+    "fold_index", "fold_prefixes",
+})
+
+# Stats of the last snapshot load/save
+SNAPSHOT_STATS: Dict[str, object] = {}
+
+
+def knowledge_snapshot_hash(
+    tripsit_path: Optional[str] = None,
+    combos_path: Optional[str] = None,
+    lexicon_path: Optional[str] = None,
+) -> str:
+    """
+    Content hash of everything a snapshot is derived from: the input files,
+    the module-defined maps, FUZZY_ENGINE, SNAPSHOT_FORMAT and this module's
+    source (so code changes also invalidate snapshots).
+    """
+    h = hashlib.sha256()
+    h.update(f"format={SNAPSHOT_FORMAT};engine={FUZZY_ENGINE};".encode())
+    with open(__file__, "rb") as f:
+        h.update(f.read())
+    for label, path in (("drugs", tripsit_path), ("combos", combos_path),
+                        ("lexicon", lexicon_path)):
+        h.update(f";{label}=".encode())
+        if path:
+            with open(path, "rb") as f:
+                h.update(f.read())
+    maps = [BASE_DRUG_CONFIG, SLANG_MAP, _PRISTINE_NORMALISATION_MAP,
+            _PRISTINE_PHRASE_NORMALISATION]
+    h.update(json.dumps(maps, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def save_knowledge_snapshot(path: str, digest: str) -> bool:
+    """
+    Write the current drug config, alias maps, non-drug words, combo
+    penalties and lookup indexes to path (pickle, written atomically),
+    after a one-line header with SNAPSHOT_FORMAT, digest
+    (knowledge_snapshot_hash of the inputs) and the pickle's sha256.
+    Snapshots are local build artefacts: only load ones this code wrote.
+
+    Returns whether it was written; a failure (e.g. an unwritable
+    directory) is recorded in SNAPSHOT_STATS["error"] instead of raised,
+    since the config itself is already built.
+    """
+    t0 = time.perf_counter()
+    snapshot = {
+        "drug_config": DRUG_CONFIG,
+        "tripsit_drug_names": TRIPSIT_DRUG_NAMES,
+        "normalisation_map": NORMALISATION_MAP,
+        "phrase_normalisation": PHRASE_NORMALISATION,
+        "non_drug_words": NON_DRUG_WORDS,
+        "non_drug_lexicon": NON_DRUG_LEXICON,
+        "combo_penalties": TRIPSIT_COMBO_PENALTIES,
+        "combo_labels": TRIPSIT_COMBO_LABELS,
+        "fuzzy_index": FUZZY_INDEX,
+        "fuzzy_index_stats": FUZZY_INDEX_STATS,
+        "suggest_index": SUGGEST_INDEX,
+        "phonetic_index": PHONETIC_INDEX,
+        "fold_index": FOLD_INDEX,
+        "fold_prefixes": _FOLD_PREFIXES,
+    }
+    SNAPSHOT_STATS.clear()
+    SNAPSHOT_STATS.update({"path": path, "hash": digest, "loaded": False})
+
+    # one temp file per writer: workers starting together may all rebuild
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix=os.path.basename(path) + ".", suffix=".tmp",
+        )
+        payload = pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        header = b"%s %d %s %s\n" % (
+            _SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, digest.encode(),
+            hashlib.sha256(payload).hexdigest().encode(),
+        )
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except (OSError, pickle.PicklingError) as exc:
+        SNAPSHOT_STATS["error"] = repr(exc)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    SNAPSHOT_STATS.update({
+        "seconds": time.perf_counter() - t0,
+        "bytes": os.path.getsize(path),
+    })
+    return True
+
+
+def load_knowledge_snapshot(path: str, digest: str) -> bool:
+    """
+    Replace the drug config, alias maps, non-drug words, combo penalties
+    and lookup indexes with the snapshot at path, if it exists and was
+    built from inputs with the given digest. Returns whether it was loaded.
+    The header (format, digest and payload hash) is checked before anything
+    is unpickled; any mismatch or unpickling error is a miss.
+    """
+    global DRUG_CONFIG, NORMALISATION_MAP, PHRASE_NORMALISATION, NON_DRUG_WORDS
+    global NON_DRUG_LEXICON, TRIPSIT_COMBO_PENALTIES, TRIPSIT_COMBO_LABELS, TRIPSIT_DRUG_NAMES
+    global FUZZY_INDEX, FUZZY_INDEX_STATS, SUGGEST_INDEX, PHONETIC_INDEX
+    global FOLD_INDEX, _FOLD_PREFIXES
+
+    t0 = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            header = f.readline(256).split()
+            if header[:3] != [_SNAPSHOT_MAGIC, b"%d" % SNAPSHOT_FORMAT, digest.encode()]:
+                return False
+            payload = f.read()
+    except OSError:  # missing or unreadable: rebuild instead
+        return False
+    if len(header) != 4 or hashlib.sha256(payload).hexdigest().encode() != header[3]:
+        return False  # truncated or altered after it was written
+    try:
+        snapshot = pickle.loads(payload)
+    except Exception:
+        return False
+    if not isinstance(snapshot, dict) or not _SNAPSHOT_KEYS <= snapshot.keys():
+        return False
+
+    DRUG_CONFIG = snapshot["drug_config"]
+    TRIPSIT_DRUG_NAMES = snapshot["tripsit_drug_names"]
+    NORMALISATION_MAP = snapshot["normalisation_map"]
+    PHRASE_NORMALISATION = snapshot["phrase_normalisation"]
+    NON_DRUG_WORDS = snapshot["non_drug_words"]
+    NON_DRUG_LEXICON = snapshot["non_drug_lexicon"]
+    TRIPSIT_COMBO_PENALTIES = snapshot["combo_penalties"]
+    TRIPSIT_COMBO_LABELS = snapshot["combo_labels"]
+    FUZZY_INDEX = snapshot["fuzzy_index"]
+    FUZZY_INDEX_STATS = snapshot["fuzzy_index_stats"]
+    SUGGEST_INDEX = snapshot["suggest_index"]
+    PHONETIC_INDEX = snapshot["phonetic_index"]
+    FOLD_INDEX = snapshot["fold_index"]
+    _FOLD_PREFIXES = snapshot["fold_prefixes"]
+
+    # cached resolutions and the token trie belong to the old config
+    bump_config_version()
+
+    SNAPSHOT_STATS.clear()
+    SNAPSHOT_STATS.update({
+        "path": path,
+        "hash": digest,
+        "loaded": True,
+        "seconds": time.perf_counter() - t0,
+        "bytes": os.path.getsize(path),
+    })
+    return True
+
+# =============================================================================
+# 2b. BACKGROUND WARM-UP
+# =============================================================================
+#
+# start_warmup() runs initialise_drug_config in a daemon thread so the
+# process can serve health checks at once; triage_from_text_and_context
+# and triage_many block in ensure_ready() until the config is loaded.
+# Without start_warmup the module behaves as before (initialise_drug_config
+# is called synchronously and ensure_ready returns immediately).
+
+# Seconds triage_from_text_and_context waits for the warm-up (None = forever)
+WARMUP_TIMEOUT: Optional[float] = 60.0
+
+# Stats of the last warm-up
+WARMUP_STATS: Dict[str, object] = {}
+
+_WARMUP_READY = threading.Event()
+_WARMUP_READY.set()  # nothing to wait for until start_warmup is called
+_WARMUP_THREAD: Optional[threading.Thread] = None
+_WARMUP_ERROR: Optional[Exception] = None
+_WARMUP_KWARGS: dict = {}
+_WARMUP_RETRY = False  # a failure was reported; the next ensure_ready retries
+_WARMUP_LOCK = threading.Lock()  # guards the thread, kwargs, error and retry flag
+
+
+def _warmup(kwargs: dict) -> None:
+    global _WARMUP_ERROR
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        initialise_drug_config(**kwargs)
+        # the phrase trie is otherwise built by the first extraction
+        get_token_trie()
+        ok = True
+    except Exception as exc:  # surfaced by ensure_ready
+        with _WARMUP_LOCK:
+            _WARMUP_ERROR = exc
+    finally:
+        if not ok and _WARMUP_ERROR is None:
+            with _WARMUP_LOCK:
+                _WARMUP_ERROR = RuntimeError("Drug config warm-up was interrupted")
+        WARMUP_STATS.update({"seconds": time.perf_counter() - t0, "ok": ok})
+        _WARMUP_READY.set()
+
+
+def start_warmup(**kwargs) -> threading.Thread:
+    """
+    Run initialise_drug_config(**kwargs) in a background thread and return
+    it. If a warm-up is already running, that thread is returned instead.
+    The kwargs are kept so a failed warm-up can be retried (see ensure_ready).
+    """
+    with _WARMUP_LOCK:
+        return _start_warmup_locked(kwargs)
+
+
+def _start_warmup_locked(kwargs: dict) -> threading.Thread:
+    """start_warmup with _WARMUP_LOCK already held."""
+    global _WARMUP_THREAD, _WARMUP_ERROR, _WARMUP_KWARGS, _WARMUP_RETRY
+    if _WARMUP_THREAD is not None and _WARMUP_THREAD.is_alive():
+        return _WARMUP_THREAD
+    _WARMUP_KWARGS = dict(kwargs)
+    _WARMUP_ERROR = None
+    _WARMUP_RETRY = False
+    _WARMUP_READY.clear()
+    WARMUP_STATS.clear()
+    _WARMUP_THREAD = threading.Thread(
+        target=_warmup, args=(_WARMUP_KWARGS,), name="triage-warmup", daemon=True
+    )
+    _WARMUP_THREAD.start()
+    return _WARMUP_THREAD
+
+
+def is_ready() -> bool:
+    """Non-blocking readiness check (e.g. for health endpoints)."""
+    return _WARMUP_READY.is_set() and _WARMUP_ERROR is None
+
+
+def ensure_ready(timeout: Optional[float] = None) -> None:
+    """
+    Block until the background warm-up has finished. Raises TimeoutError
+    if it is still running after timeout seconds, and RuntimeError if it
+    failed. After a reported failure the next call starts the warm-up
+    again with the same arguments (and waits for it), so a fixed input
+    file does not need a process restart.
+    """
+    global _WARMUP_RETRY
+    with _WARMUP_LOCK:
+        # only the first caller after a failure starts the retry
+        if _WARMUP_RETRY:
+            _start_warmup_locked(_WARMUP_KWARGS)
+    if not _WARMUP_READY.wait(timeout):
+        raise TimeoutError(f"Drug config warm-up still running after {timeout}s")
+    with _WARMUP_LOCK:
+        error = _WARMUP_ERROR
+        if error is not None:
+            _WARMUP_RETRY = True
+    if error is not None:
+        raise RuntimeError("Drug config warm-up failed") from error
+
+
+# =============================================================================
+# 2c. HOT RELOAD (atomic config swap)
+# =============================================================================
+#
+# Triages hold KB_LOCK for reading; initialise_drug_config and reloads hold
+# it for writing, so a swap waits for in-flight triages and they never see
+# a half-built config. reload_knowledge_base builds the new snapshot in a
+# child process (off the request path, without touching the live globals)
+# and only the snapshot load (~10ms) happens under the write lock.
+
+
+class _ReadWriteLock:
+    """Many readers or one writer; waiting writers block new readers."""
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self) -> None:
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self) -> None:
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self) -> None:
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+KB_LOCK = _ReadWriteLock()
+
+# Input digest prefix of the current config; reported as "snapshot_version"
+SNAPSHOT_VERSION: Optional[str] = None
+
+# Stats of the last reload check
+RELOAD_STATS: Dict[str, object] = {}
+
+# Characters of a failed snapshot build's stderr kept in its error
+RELOAD_ERROR_CHARS = 1000
+
+_RELOAD_THREAD: Optional[threading.Thread] = None
+_RELOAD_STOP = threading.Event()
+
+# Runs initialise_drug_config(**json.loads(argv[2])) with this module
+_SNAPSHOT_BUILDER = (
+    "import json, sys; sys.path.insert(0, sys.argv[1]); "
+    "import triage_core; triage_core.initialise_drug_config(**json.loads(sys.argv[2]))"
+)
+
+
+def _build_snapshot_in_child(path: str, kwargs: dict) -> None:
+    """
+    Write a knowledge snapshot for kwargs to path from a fresh interpreter.
+    Raises RuntimeError with the end of the child's stderr if it fails.
+    """
+    kwargs = dict(kwargs, snapshot_path=path,
+                  fuzzy_engine=FUZZY_ENGINE, distance_budget=FUZZY_DISTANCE_BUDGET)
+    try:
+        subprocess.run(
+            [sys.executable, "-c", _SNAPSHOT_BUILDER,
+             os.path.dirname(os.path.abspath(__file__)), json.dumps(kwargs)],
+            check=True, capture_output=True,
+        )
+    except subprocess.CalledProcessError as exc:
+        # the traceback's last lines name the bad input
+        stderr = (exc.stderr or b"").decode("utf-8", "replace").strip()
+        raise RuntimeError(
+            f"Snapshot build failed (exit {exc.returncode}): "
+            f"{stderr[-RELOAD_ERROR_CHARS:]}"
+        ) from exc
+
+
+def reload_knowledge_base(
+    tripsit_path: Optional[str] = None,
+    lexicon_path: Optional[str] = None,
+    combos_path: Optional[str] = None,
+    snapshot_path: Optional[str] = None,
+) -> bool:
+    """
+    Swap in a config built from the current input files if their content
+    hash differs from SNAPSHOT_VERSION. Takes the same paths as
+    initialise_drug_config (and keeps the current fuzzy engine); with
+    snapshot_path the rebuilt snapshot is kept there for the next start.
+    Returns whether a new config was installed. On failure the old config
+    stays in place.
+
+    The new config is built from the input files only: registries in
+    REGISTRY_SOURCES are streamed in again after the swap (triages in
+    between miss their entries), and apply_tripsit_update changes survive
+    only if tripsit_path / combos_path are its new files.
+    """
+    global SNAPSHOT_VERSION
+    t0 = time.perf_counter()
+    digest = knowledge_snapshot_hash(tripsit_path, combos_path, lexicon_path)
+    RELOAD_STATS.update({"checked": time.time(), "hash": digest})
+    if digest[:12] == SNAPSHOT_VERSION:
+        return False
+
+    kwargs = {"tripsit_path": tripsit_path, "lexicon_path": lexicon_path,
+              "combos_path": combos_path}
+    if snapshot_path:
+        build_path = snapshot_path
+    else:
+        fd, build_path = tempfile.mkstemp(suffix=".snapshot")
+        os.close(fd)
+    try:
+        _build_snapshot_in_child(build_path, kwargs)
+        with KB_LOCK.write():
+            # False if an input changed again since it was hashed
+            if not load_knowledge_snapshot(build_path, digest):
+                return False
+            SNAPSHOT_VERSION = digest[:12]
+    finally:
+        if not snapshot_path:
+            os.remove(build_path)
+
+    for source in list(REGISTRY_SOURCES):
+        ingest_substance_registry(**source)
+
+    RELOAD_STATS.update({
+        "reloaded": time.time(),
+        "version": SNAPSHOT_VERSION,
+        "seconds": time.perf_counter() - t0,
+    })
+    return True
+
+
+def _input_mtimes(paths: Iterable[Optional[str]]) -> Tuple[Optional[float], ...]:
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime if path else None)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def _reload_loop(interval: float, kwargs: dict) -> None:
+    paths = (kwargs.get("tripsit_path"), kwargs.get("combos_path"), kwargs.get("lexicon_path"))
+    seen = _input_mtimes(paths)
+    while not _RELOAD_STOP.wait(interval):
+        mtimes = _input_mtimes(paths)
+        if mtimes == seen:
+            continue
+        try:
+            # a touch without content change is caught by the hash check
+            reload_knowledge_base(**kwargs)
+            seen = mtimes
+        except Exception as exc:  # keep serving the old config, retry next tick
+            RELOAD_STATS["error"] = repr(exc)
+
+
+def start_reloader(interval: float = 5.0, **kwargs) -> threading.Thread:
+    """
+    Poll the mtimes of the input files every interval seconds and call
+    reload_knowledge_base(**kwargs) when they change. kwargs are the paths
+    given to initialise_drug_config. Stop with stop_reloader().
+    """
+    global _RELOAD_THREAD
+    stop_reloader()
+    _RELOAD_STOP.clear()
+    _RELOAD_THREAD = threading.Thread(
+        target=_reload_loop, args=(interval, kwargs), name="triage-reload", daemon=True
+    )
+    _RELOAD_THREAD.start()
+    return _RELOAD_THREAD
+
+
+def stop_reloader() -> None:
+    global _RELOAD_THREAD
+    if _RELOAD_THREAD is not None:
+        _RELOAD_STOP.set()
+        _RELOAD_THREAD.join()
+        _RELOAD_THREAD = None
+
+
+# =============================================================================
+# 2d. INCREMENTAL TRIPSIT UPDATES
+# =============================================================================
+
+
+def _tripsit_drug_entries(data: Dict[str, dict]) -> Dict[str, Tuple[str, int]]:
+    """
+    name -> (category, score) that load_tripsit_drugs leaves in DRUG_CONFIG
+    for each drugs.json name, including the merge with BASE_DRUG_CONFIG
+    done by ingest_drug_record.
+    """
+    entries: Dict[str, Tuple[str, int]] = {}
+    for drug_name, meta in data.items():
+        name = drug_name.lower().strip()
+        if not name:
+            continue
+        category = _tripsit_internal_category(meta)
+        score = CATEGORY_DEFAULT_SCORE.get(category, 2)
+        if category not in CATEGORY_DEFAULT_SCORE:
+            category = "other"
+
+        existing = entries.get(name)
+        if existing is None and name in BASE_DRUG_CONFIG:
+            base = BASE_DRUG_CONFIG[name]
+            existing = (str(base["category"]), int(base["score"]))
+        if existing is not None:
+            score = max(existing[1], score)
+            if existing[0] != "unknown" or category == "unknown":
+                category = existing[0]
+        entries[name] = (category, score)
+    return entries
+
+
+def _tripsit_alias_owners(data: Dict[str, dict]) -> Dict[str, str]:
+    """alias -> canonical name; the first entry wins, as in build_alias_maps_from_tripsit."""
+    owners: Dict[str, str] = {}
+    for canonical, meta in data.items():
+        canon = canonical.lower().strip()
+        for alias in _tripsit_aliases(canon, meta):
+            owners.setdefault(alias, canon)
+    return owners
+
+
+def _sync_label_indexes(labels: Iterable[str]) -> None:
+    """Add labels to, or discard them from, the lookup indexes to match the current maps."""
+    for label in labels:
+        info = DRUG_CONFIG.get(label)
+        is_drug = label in BASE_DRUG_CONFIG or info is not None
+        known_drug = label in BASE_DRUG_CONFIG or (info is not None and info["category"] != "unknown")
+        is_alias = label in SLANG_MAP or label in NORMALISATION_MAP or label in PHRASE_NORMALISATION
+
+        if FUZZY_INDEX is not None:
+            if is_drug or (is_alias and FUZZY_INDEX.include_aliases):
+                FUZZY_INDEX.add(label)
+            else:
+                FUZZY_INDEX.discard(label)
+        if SUGGEST_INDEX is not None:
+            if (
+                label in BASE_DRUG_CONFIG
+                or label in TRIPSIT_DRUG_NAMES
+                or label in REGISTRY_DRUG_NAMES
+                or is_alias
+            ):
+                SUGGEST_INDEX.add(label)
+            else:
+                SUGGEST_INDEX.discard(label)
+        if PHONETIC_INDEX is not None:
+            if known_drug or label in SLANG_MAP or label in NORMALISATION_MAP:
+                _add_phonetic_label(label)
+            else:
+                _discard_phonetic_label(label)
+    refresh_fold_keys(labels)
+
+
+def _combo_pair(key: frozenset) -> Tuple[str, ...]:
+    return tuple(sorted(key))
+
+
+def apply_tripsit_update(
+    old_path: str,
+    new_path: str,
+    old_combos_path: Optional[str] = None,
+    new_combos_path: Optional[str] = None,
+) -> Dict[str, object]:
+    """
+    Bring a config loaded from old_path (drugs.json) and old_combos_path up
+    to date with new_path and new_combos_path without a rebuild: only the
+    drug entries, aliases and combo pairs that differ are written to
+    DRUG_CONFIG, the alias maps and TRIPSIT_COMBO_PENALTIES / LABELS, the
+    lookup indexes are updated for those labels only, and only the token
+    cache entries for them are dropped (see invalidate_labels). The result
+    matches initialise_drug_config on the new files; entries inferred at
+    runtime are kept. A later hot reload rebuilds from its own paths, so
+    replace the files in place (or reload from new_path) to keep it.
+
+    Returns a change report: added / removed / changed drugs, aliases and
+    combo pairs, the number of cache entries dropped, the new
+    SNAPSHOT_VERSION and the time taken.
+    """
+    global NON_DRUG_WORDS, SNAPSHOT_VERSION, TAGGING_VERSION, TRIPSIT_COMBO_LABELS
+    t0 = time.perf_counter()
+
+    old_data, new_data = read_tripsit_drugs(old_path), read_tripsit_drugs(new_path)
+    old_entries, new_entries = _tripsit_drug_entries(old_data), _tripsit_drug_entries(new_data)
+    old_owners, new_owners = _tripsit_alias_owners(old_data), _tripsit_alias_owners(new_data)
+
+    drugs_added = sorted(new_entries.keys() - old_entries.keys())
+    drugs_removed = sorted(old_entries.keys() - new_entries.keys())
+    drugs_changed = sorted(
+        name for name in old_entries.keys() & new_entries.keys()
+        if old_entries[name] != new_entries[name]
+    )
+    aliases = sorted(
+        alias for alias in old_owners.keys() | new_owners.keys()
+        if old_owners.get(alias) != new_owners.get(alias)
+    )
+
+    old_penalties: Dict[frozenset, int] = {}
+    new_penalties: Dict[frozenset, int] = {}
+    old_combo_labels: Set[str] = set()
+    new_combo_labels: Set[str] = set()
+    if old_combos_path and new_combos_path:
+        old_penalties, old_combo_labels = read_tripsit_combos(old_combos_path)
+        new_penalties, new_combo_labels = read_tripsit_combos(new_combos_path)
+    combos_changed = [
+        key for key in old_penalties.keys() | new_penalties.keys()
+        if old_penalties.get(key) != new_penalties.get(key)
+    ]
+
+    with KB_LOCK.write():
+        for name in drugs_added + drugs_changed:
+            category, score = new_entries[name]
+            DRUG_CONFIG[name] = {"category": category, "score": score}
+            TRIPSIT_DRUG_NAMES.add(name)
+        for name in drugs_removed:
+            TRIPSIT_DRUG_NAMES.discard(name)
+            if name in BASE_DRUG_CONFIG:
+                DRUG_CONFIG[name] = dict(BASE_DRUG_CONFIG[name])
+            else:
+                DRUG_CONFIG.pop(name, None)
+
+        affected = set(drugs_added) | set(drugs_removed) | set(drugs_changed)
+        for alias in aliases:
+            phrase = " " in alias
+            target = PHRASE_NORMALISATION if phrase else NORMALISATION_MAP
+            pristine = _PRISTINE_PHRASE_NORMALISATION if phrase else _PRISTINE_NORMALISATION_MAP
+            if alias in pristine:
+                continue  # manual entries always win
+            affected.add(alias)
+            affected.update(owner for owner in (old_owners.get(alias), new_owners.get(alias)) if owner)
+            if alias in new_owners:
+                target[alias] = new_owners[alias]
+            else:
+                target.pop(alias, None)
+
+        _sync_label_indexes(sorted(affected))
+
+        # the lexicon never hides a label (see load_non_drug_lexicon)
+        known = {
+            label for label in affected
+            if label in BASE_DRUG_CONFIG or label in DRUG_CONFIG or label in SLANG_MAP
+            or label in NORMALISATION_MAP or label in PHRASE_NORMALISATION
+        }
+        NON_DRUG_WORDS = frozenset(
+            (NON_DRUG_WORDS - known) | ((affected - known) & NON_DRUG_LEXICON)
+        )
+
+        if combos_changed or old_combo_labels != new_combo_labels:
+            for key in combos_changed:
+                if key in new_penalties:
+                    TRIPSIT_COMBO_PENALTIES[key] = new_penalties[key]
+                else:
+                    TRIPSIT_COMBO_PENALTIES.pop(key, None)
+            TRIPSIT_COMBO_LABELS -= old_combo_labels - new_combo_labels
+            TRIPSIT_COMBO_LABELS |= new_combo_labels - old_combo_labels
+
+        invalidated = 0
+        if affected:
+            TAGGING_VERSION += 1
+            invalidated = invalidate_labels(affected)
+
+        if affected or combos_changed:
+            h = hashlib.sha256(f"{SNAPSHOT_VERSION};".encode())
+            for path in (new_path, new_combos_path):
+                if path:
+                    with open(path, "rb") as f:
+                        h.update(f.read())
+            SNAPSHOT_VERSION = h.hexdigest()[:12]
+
+    def pairs(keys):
+        return sorted(_combo_pair(key) for key in keys)
+
+    return {
+        "drugs_added": drugs_added,
+        "drugs_removed": drugs_removed,
+        "drugs_changed": drugs_changed,
+        "aliases_added": [a for a in aliases if a not in old_owners],
+        "aliases_removed": [a for a in aliases if a not in new_owners],
+        "aliases_changed": [a for a in aliases if a in old_owners and a in new_owners],
+        "combos_added": pairs(k for k in combos_changed if k not in old_penalties),
+        "combos_removed": pairs(k for k in combos_changed if k not in new_penalties),
+        "combos_changed": pairs(
+            k for k in combos_changed if k in old_penalties and k in new_penalties
+        ),
+        "cache_entries_invalidated": invalidated,
+        "snapshot_version": SNAPSHOT_VERSION,
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+# =============================================================================
+# 2e. SUBSTANCE REGISTRY INGESTION (EMCDDA / NPS Discovery style)
+# =============================================================================
+#
+# Registries list far more substances than drugs.json, one record per row.
+# They are read as a stream (csv.DictReader / one json.loads per line), so
+# memory does not grow with file size beyond the entries actually added
+# to DRUG_CONFIG, and the lookup indexes are rebuilt once at the end
+# instead of per record.
+
+# Registry class (substring of the lowercased class) -> internal category,
+# checked in order; anything else goes through map_tripsit_category_to_internal
+REGISTRY_CLASS_RULES: List[Tuple[str, str]] = [
+    ("nitazene", "nitazene"),
+    ("benzimidazole", "nitazene"),  # 2-benzylbenzimidazole opioids
+    ("synthetic cannabinoid", "synthetic_cannabinoid"),
+    ("cannabimimetic", "synthetic_cannabinoid"),
+    ("fentanyl", "opioid"),
+    ("opioid", "opioid"),
+    ("opiate", "opioid"),
+    ("benzodiazepine", "benzodiazepine"),
+    ("gabapentinoid", "gabapentinoid"),
+    ("cathinone", "stimulant"),
+    ("aminoindane", "stimulant"),
+    ("piperazine", "stimulant"),
+    ("tryptamine", "psychedelic"),
+    ("lysergamide", "psychedelic"),
+    ("arylcyclohexylamine", "dissociative"),
+    # phenethylamines span psychedelics and stimulants; take the higher score
+    ("phenethylamine", "psychedelic"),
+]
+
+# Rows merged per KB_LOCK write section, so triages can run during a load
+REGISTRY_BATCH_SIZE = 5000
+
+# Stats of the last ingest_substance_registry call
+REGISTRY_LOAD_STATS: Dict[str, object] = {}
+
+# ingest_substance_registry arguments of each registry loaded since the
+# last initialise_drug_config; reload_knowledge_base ingests them again
+REGISTRY_SOURCES: List[Dict[str, object]] = []
+
+# Names merged from those registries (offered by suggest_drugs)
+REGISTRY_DRUG_NAMES: Set[str] = set()
+
+
+def map_registry_class_to_internal(ext_class: Union[str, List[str], None]) -> str:
+    """
+    Map a registry substance class (or a list of classes, e.g. from JSON
+    lines) onto the internal categories. For several classes the one with
+    the highest default score wins (conservative).
+    """
+    if isinstance(ext_class, (list, tuple)):
+        categories = [map_registry_class_to_internal(c) for c in ext_class if c]
+        if not categories:
+            return "other"
+        return max(categories, key=lambda c: CATEGORY_DEFAULT_SCORE.get(c, 0))
+
+    text = (ext_class or "").lower().strip()
+    for needle, category in REGISTRY_CLASS_RULES:
+        if needle in text:
+            return category
+    return map_tripsit_category_to_internal(text)
+
+
+def _iter_registry_rows(path: str, fmt: str) -> Iterator[Optional[dict]]:
+    """Rows of a CSV or JSON-lines file as dicts (None for an unreadable line)."""
+    if fmt == "csv":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield None
+                    continue
+                yield row if isinstance(row, dict) else None
+
+
+def ingest_substance_registry(
+    path: str,
+    name_field: str = "name",
+    class_field: str = "class",
+    fmt: Optional[str] = None,
+    trace_memory: bool = False,
+) -> Dict[str, object]:
+    """
+    Stream a substance registry (CSV with a header row, or JSON lines) into
+    DRUG_CONFIG. Each record's class_field is mapped with
+    map_registry_class_to_internal and merged like ingest_drug_record
+    (highest score kept, 'unknown' categories refined). fmt is "csv" or
+    "jsonl" (default: from the file extension). Rows without a name are
+    skipped. The registry is recorded in REGISTRY_SOURCES, so a hot reload
+    streams it in again.
+
+    Returns (and stores in REGISTRY_LOAD_STATS) rows read, merged, skipped,
+    new names, elapsed time and rows per second, plus peak traced memory
+    when trace_memory is set.
+    """
+    if fmt is None:
+        fmt = "csv" if path.lower().endswith(".csv") else "jsonl"
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Unknown registry format {fmt!r}; expected 'csv' or 'jsonl'")
+
+    if trace_memory:
+        import tracemalloc
+
+        was_tracing = tracemalloc.is_tracing()
+        if was_tracing:
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+
+    t0 = time.perf_counter()
+    rows = merged = skipped = new_names = 0
+    batch: List[Tuple[str, str]] = []
+
+    def flush() -> int:
+        added = 0
+        with KB_LOCK.write():
+            for name, category in batch:
+                added += _merge_drug_record(name, category, CATEGORY_DEFAULT_SCORE[category])
+                REGISTRY_DRUG_NAMES.add(name)
+            bump_config_version()
+        batch.clear()
+        return added
+
+    for row in _iter_registry_rows(path, fmt):
+        rows += 1
+        name = str((row or {}).get(name_field) or "").lower().strip()
+        if not name:
+            skipped += 1
+            continue
+        batch.append((name, map_registry_class_to_internal(row.get(class_field))))
+        merged += 1
+        if len(batch) >= REGISTRY_BATCH_SIZE:
+            new_names += flush()
+    new_names += flush()
+
+    if new_names:
+        with KB_LOCK.write():
+            rebuild_fuzzy_index()
+            rebuild_phonetic_index()
+            rebuild_fold_index()
+            rebuild_suggest_index()
+
+    seconds = time.perf_counter() - t0
+    peak_bytes = None
+    if trace_memory:
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        if not was_tracing:
+            tracemalloc.stop()
+
+    source = {"path": path, "name_field": name_field, "class_field": class_field, "fmt": fmt}
+    if source not in REGISTRY_SOURCES:
+        REGISTRY_SOURCES.append(source)
+
+    REGISTRY_LOAD_STATS.clear()
+    REGISTRY_LOAD_STATS.update({
+        "path": path,
+        "format": fmt,
+        "rows": rows,
+        "merged": merged,
+        "skipped": skipped,
+        "new_names": new_names,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds else None,
+        "peak_bytes": peak_bytes,
+    })
+    return dict(REGISTRY_LOAD_STATS)
+
 
 # =============================================================================
 # 3. TRIPSIT COMBO PENALTIES (combos.json)
@@ -422,23 +1590,29 @@ def load_tripsit_combos(json_path: str) -> None:
     Keys are stored lowercased; TRIPSIT_COMBO_LABELS holds all labels.
     """
     global TRIPSIT_COMBO_PENALTIES, TRIPSIT_COMBO_LABELS
-    TRIPSIT_COMBO_PENALTIES = {}
-    TRIPSIT_COMBO_LABELS = set()
+    TRIPSIT_COMBO_PENALTIES, TRIPSIT_COMBO_LABELS = read_tripsit_combos(json_path)
+
+
+def read_tripsit_combos(json_path: str) -> Tuple[Dict[frozenset, int], Set[str]]:
+    """Parse combos.json into (pair penalties, labels), as load_tripsit_combos stores them."""
+    penalties: Dict[frozenset, int] = {}
+    labels: Set[str] = set()
 
     with open(json_path, "r", encoding="utf-8") as f:
         data = json.load(f)
 
     for substance, partners in data.items():
         s1 = substance.lower().strip()
-        TRIPSIT_COMBO_LABELS.add(s1)
+        labels.add(s1)
         for partner, info in partners.items():
             s2 = partner.lower().strip()
-            TRIPSIT_COMBO_LABELS.add(s2)
+            labels.add(s2)
             status = (info.get("status") or "unknown").lower().strip()
             penalty = TRIPSIT_STATUS_TO_PENALTY.get(status, TRIPSIT_STATUS_TO_PENALTY["unknown"])
             key = frozenset({s1, s2})
-            existing = TRIPSIT_COMBO_PENALTIES.get(key, 0)
-            TRIPSIT_COMBO_PENALTIES[key] = max(existing, penalty)
+            existing = penalties.get(key, 0)
+            penalties[key] = max(existing, penalty)
+    return penalties, labels
 
 def map_drug_to_tripsit_label(drug_name: str) -> str:
     """
@@ -556,8 +1730,12 @@ def fuzzy_match_drug(token: str, known_drugs: list, max_distance: int = 2) -> st
     best_distance = 999
 
     for drug in known_drugs:
-        dist = levenshtein(token, drug)
-        if dist < best_distance:
+        # only a strictly better match within max_distance matters
+        bound = min(best_distance - 1, max_distance)
+        if bound < 0:
+            break
+        dist = levenshtein_within(token, drug, bound)
+        if dist <= bound:
             best_distance = dist
             best_match = drug
 
@@ -566,6 +1744,1209 @@ def fuzzy_match_drug(token: str, known_drugs: list, max_distance: int = 2) -> st
 
     return token  # no correction; handled as unknown
 
+# =============================================================================
+# 4a. FUZZY MATCHING INDEXES
+# =============================================================================
+
+class BKTree:
+    """
+    Burkhard-Keller tree over drug labels, using Levenshtein distance.
+
+    Each node is [label, {edge_distance: child_node}]. A lookup only descends
+    into children whose edge distance is within the search radius of the
+    distance to the current node (triangle inequality), so a distance-<=2
+    query visits a small fraction of the labels. Discarded labels keep
+    their node (it still routes lookups) but are never returned.
+    """
+
+    name = "bktree"
+    include_aliases = False
+
+    def __init__(self, labels: Iterable[str] = ()) -> None:
+        self.root: Optional[list] = None
+        self.labels: Set[str] = set()
+        self.discarded: Set[str] = set()
+        for label in labels:
+            self.add(label)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def add(self, label: str) -> None:
+        if label in self.labels:
+            return
+        self.labels.add(label)
+        if label in self.discarded:
+            self.discarded.discard(label)
+            return
+
+        if self.root is None:
+            self.root = [label, {}]
+            return
+
+        node = self.root
+        while True:
+            dist = levenshtein(label, node[0])
+            child = node[1].get(dist)
+            if child is None:
+                node[1][dist] = [label, {}]
+                return
+            node = child
+
+    def closest(self, token: str, max_distance: int) -> Optional[Tuple[str, int]]:
+        """
+        Return (label, distance) for the closest label within max_distance,
+        or None. Ties are broken by the lexicographically smallest label.
+        """
+        if token in self.labels:
+            return token, 0
+        if self.root is None:
+            return None
+
+        best_label = None
+        best_distance = max_distance
+        stack = [self.root]
+        while stack:
+            label, children = stack.pop()
+            # beyond best_distance + the widest edge, no child can qualify
+            # either, so the exact distance is not needed
+            radius = max(children) if children else 0
+            dist = levenshtein_within(token, label, best_distance + radius)
+            if dist > best_distance and not children:
+                continue
+            if label in self.discarded:
+                pass
+            elif dist < best_distance or (
+                dist == best_distance and (best_label is None or label < best_label)
+            ):
+                best_label, best_distance = label, dist
+
+            # children[e] can only hold labels at distance >= |dist - e|
+            for edge, child in children.items():
+                if abs(edge - dist) <= best_distance:
+                    stack.append(child)
+
+        if best_label is None:
+            return None
+        return best_label, best_distance
+
+    def discard(self, label: str) -> None:
+        if label in self.labels:
+            self.labels.discard(label)
+            self.discarded.add(label)
+
+    def memory_bytes(self) -> int:
+        total = sys.getsizeof(self.labels) + sys.getsizeof(self.discarded)
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            total += sys.getsizeof(node) + sys.getsizeof(node[0]) + sys.getsizeof(node[1])
+            stack.extend(node[1].values())
+        return total
+
+
+class SymSpellIndex:
+    """
+    SymSpell-style deletion dictionary.
+
+    Every label is expanded to all variants with up to max_edit characters
+    deleted, and each variant maps back to the labels it came from. Two
+    strings within Levenshtein distance k always share a variant reachable
+    by <= k deletions from each side, so a lookup only has to generate the
+    token's own deletes and verify the short candidate list.
+
+    Besides drug labels this index also covers alias, slang and phrase keys
+    (include_aliases); matches on those are mapped back to their canonical
+    name by fuzzy_lookup.
+    """
+
+    name = "symspell"
+    include_aliases = True
+
+    def __init__(self, labels: Iterable[str] = (), max_edit: int = 2) -> None:
+        self.max_edit = max_edit
+        self.deletes: Dict[str, Set[str]] = {}
+        self.labels: Set[str] = set()
+        for label in labels:
+            self.add(label)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    @staticmethod
+    def _variants(word: str, max_edit: int) -> Set[str]:
+        """All strings obtained from word by deleting up to max_edit characters."""
+        variants = {word}
+        frontier = {word}
+        for _ in range(max_edit):
+            nxt = set()
+            for w in frontier:
+                for i in range(len(w)):
+                    nxt.add(w[:i] + w[i + 1:])
+            nxt -= variants
+            variants |= nxt
+            frontier = nxt
+        return variants
+
+    def add(self, label: str) -> None:
+        if label in self.labels:
+            return
+        self.labels.add(label)
+        for variant in self._variants(label, self.max_edit):
+            bucket = self.deletes.get(variant)
+            if bucket is None:
+                self.deletes[variant] = {label}
+            else:
+                bucket.add(label)
+
+    def closest(self, token: str, max_distance: int) -> Optional[Tuple[str, int]]:
+        """Same contract as BKTree.closest (max_distance is capped at max_edit)."""
+        if token in self.labels:
+            return token, 0
+
+        k = min(max_distance, self.max_edit)
+        candidates: Set[str] = set()
+        for variant in self._variants(token, k):
+            bucket = self.deletes.get(variant)
+            if bucket:
+                candidates |= bucket
+
+        best = None
+        for label in candidates:
+            dist = levenshtein_within(token, label, k)
+            if dist <= k and (best is None or (dist, label) < best):
+                best = (dist, label)
+
+        if best is None:
+            return None
+        return best[1], best[0]
+
+    def discard(self, label: str) -> None:
+        if label not in self.labels:
+            return
+        self.labels.discard(label)
+        for variant in self._variants(label, self.max_edit):
+            bucket = self.deletes.get(variant)
+            if bucket is not None:
+                bucket.discard(label)
+                if not bucket:
+                    del self.deletes[variant]
+
+    def memory_bytes(self) -> int:
+        total = sys.getsizeof(self.labels) + sys.getsizeof(self.deletes)
+        for variant, bucket in self.deletes.items():
+            total += sys.getsizeof(variant) + sys.getsizeof(bucket)
+        return total
+
+
+class NumpyLabelMatrix:
+    """
+    Vectorised matcher for batch jobs (requires numpy).
+
+    All labels are packed, in sorted order, into a padded uint8 code matrix
+    with a length vector. The edit distance from a token - or a block of
+    tokens - to every label is then computed in one DP sweep, row by row
+    over the token characters. Within a row the left-neighbour dependency
+    is resolved with a running minimum:
+        D[i][j] = min_{j' <= j} (T[j'] + j - j'),
+        T[j]    = min(D[i-1][j] + 1, D[i-1][j-1] + cost)
+    The first label with the minimal distance wins, which is the same
+    answer fuzzy_match_drug gives on the sorted label list.
+    """
+
+    name = "numpy"
+    include_aliases = False
+    block_size = 64
+
+    def __init__(self, labels: Iterable[str] = ()) -> None:
+        if np is None:
+            raise ImportError("The 'numpy' fuzzy engine requires numpy to be installed.")
+        self.labels: List[str] = sorted(set(labels))
+        self.label_set: Set[str] = set(self.labels)
+        # code 0 is padding / "character not in any label"
+        self.codes: Dict[str, int] = {}
+        for label in self.labels:
+            for c in label:
+                self.codes.setdefault(c, len(self.codes) + 1)
+
+        width = max((len(label) for label in self.labels), default=1)
+        self.matrix = np.zeros((len(self.labels), width), dtype=self._dtype())
+        for row, label in enumerate(self.labels):
+            self.matrix[row, :len(label)] = self._encode(label)
+        self.lengths = np.array([len(label) for label in self.labels], dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def _dtype(self):
+        return np.uint8 if len(self.codes) < 256 else np.uint16
+
+    def _encode(self, word: str) -> List[int]:
+        return [self.codes.get(c, 0) for c in word]
+
+    def add(self, label: str) -> None:
+        if label in self.label_set:
+            return
+        for c in label:
+            self.codes.setdefault(c, len(self.codes) + 1)
+        if self.matrix.dtype != self._dtype():
+            self.matrix = self.matrix.astype(self._dtype())
+        if len(label) > self.matrix.shape[1]:
+            pad = len(label) - self.matrix.shape[1]
+            self.matrix = np.pad(self.matrix, ((0, 0), (0, pad)))
+
+        row = np.zeros(self.matrix.shape[1], dtype=self.matrix.dtype)
+        row[:len(label)] = self._encode(label)
+        pos = bisect.bisect_left(self.labels, label)
+        self.labels.insert(pos, label)
+        self.label_set.add(label)
+        self.matrix = np.insert(self.matrix, pos, row, axis=0)
+        self.lengths = np.insert(self.lengths, pos, len(label))
+
+    def discard(self, label: str) -> None:
+        if label not in self.label_set:
+            return
+        pos = bisect.bisect_left(self.labels, label)
+        del self.labels[pos]
+        self.label_set.discard(label)
+        self.matrix = np.delete(self.matrix, pos, axis=0)
+        self.lengths = np.delete(self.lengths, pos)
+
+    def _sweep(self, tokens: List[str], matrix, lengths):
+        """Distance matrix (len(tokens), len(matrix)) for one block of tokens."""
+        n_labels, width = matrix.shape
+        n_chars = max(len(t) for t in tokens)
+        tok_codes = np.zeros((len(tokens), n_chars), dtype=np.int32)
+        for b, t in enumerate(tokens):
+            tok_codes[b, :len(t)] = self._encode(t)
+        tok_lens = np.array([len(t) for t in tokens])
+
+        cols = np.arange(width + 1, dtype=np.int32)
+        rows = np.arange(n_labels)
+        prev = np.broadcast_to(cols, (len(tokens), n_labels, width + 1)).copy()
+        out = np.empty((len(tokens), n_labels), dtype=np.int32)
+        out[tok_lens == 0] = lengths
+
+        step = np.empty_like(prev)
+        for i in range(1, n_chars + 1):
+            cost = matrix[None, :, :] != tok_codes[:, i - 1, None, None]
+            step[:, :, 0] = i
+            np.minimum(prev[:, :, 1:] + 1, prev[:, :, :-1] + cost, out=step[:, :, 1:])
+            prev = np.minimum.accumulate(step - cols, axis=2) + cols
+
+            finished = tok_lens == i
+            if finished.any():
+                out[finished] = prev[finished][:, rows, lengths]
+        return out
+
+    def closest(self, token: str, max_distance: int) -> Optional[Tuple[str, int]]:
+        """Same contract as BKTree.closest."""
+        if token in self.label_set:
+            return token, 0
+        if not self.labels:
+            return None
+
+        # labels outside the length band can never be within max_distance
+        rows = np.nonzero(np.abs(self.lengths - len(token)) <= max_distance)[0]
+        if len(rows) == 0:
+            return None
+        dists = self._sweep([token], self.matrix[rows], self.lengths[rows])[0]
+        best = int(np.argmin(dists))
+        if dists[best] > max_distance:
+            return None
+        return self.labels[rows[best]], int(dists[best])
+
+    def closest_many(
+        self, tokens: List[str], max_distance: int
+    ) -> List[Optional[Tuple[str, int]]]:
+        """closest() for a batch of tokens, block_size tokens per DP sweep."""
+        results: List[Optional[Tuple[str, int]]] = [None] * len(tokens)
+        pending = []
+        for pos, token in enumerate(tokens):
+            if token in self.label_set:
+                results[pos] = (token, 0)
+            else:
+                pending.append(pos)
+        if not self.labels:
+            return results
+
+        # similar-length tokens share a block, so each sweep only needs the
+        # labels (and columns) inside that block's length band
+        pending.sort(key=lambda p: len(tokens[p]))
+        for start in range(0, len(pending), self.block_size):
+            block = pending[start:start + self.block_size]
+            lo = len(tokens[block[0]]) - max_distance
+            hi = len(tokens[block[-1]]) + max_distance
+            rows = np.nonzero((self.lengths >= lo) & (self.lengths <= hi))[0]
+            if len(rows) == 0:
+                continue
+            lengths = self.lengths[rows]
+            matrix = self.matrix[rows, :max(int(lengths.max()), 1)]
+
+            dists = self._sweep([tokens[p] for p in block], matrix, lengths)
+            best = np.argmin(dists, axis=1)
+            for b, pos in enumerate(block):
+                d = int(dists[b, best[b]])
+                if d <= max_distance:
+                    results[pos] = (self.labels[rows[best[b]]], d)
+        return results
+
+    def memory_bytes(self) -> int:
+        return (
+            self.matrix.nbytes
+            + self.lengths.nbytes
+            + sys.getsizeof(self.labels)
+            + sum(sys.getsizeof(label) for label in self.labels)
+        )
+
+
+class TrigramIndex:
+    """
+    Character-trigram inverted index over labels.
+
+    Labels are padded with two spaces on each side, giving len + 2 trigrams.
+    One edit destroys at most three trigrams, so a label of length l within
+    distance k of a token of length n shares at least max(n, l) + 2 - 3k
+    trigrams with it (q-gram lemma, counted as multisets). Only labels that
+    pass that count - or labels short enough that the bound is vacuous -
+    get an exact distance check. Long chemical names benefit most.
+    """
+
+    name = "trigram"
+    include_aliases = False
+
+    def __init__(self, labels: Iterable[str] = ()) -> None:
+        self.labels: List[str] = []                      # id -> label (kept when discarded)
+        self.ids: Dict[str, int] = {}
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}  # gram -> [(id, count)]
+        self.by_length: Dict[int, List[int]] = {}
+        for label in labels:
+            self.add(label)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def _grams(word: str) -> Dict[str, int]:
+        padded = "  " + word + "  "
+        counts: Dict[str, int] = {}
+        for i in range(len(padded) - 2):
+            gram = padded[i:i + 3]
+            counts[gram] = counts.get(gram, 0) + 1
+        return counts
+
+    def add(self, label: str) -> None:
+        if label in self.ids:
+            return
+        label_id = len(self.labels)
+        self.labels.append(label)
+        self.ids[label] = label_id
+        self.by_length.setdefault(len(label), []).append(label_id)
+        for gram, count in self._grams(label).items():
+            self.postings.setdefault(gram, []).append((label_id, count))
+
+    def discard(self, label: str) -> None:
+        label_id = self.ids.pop(label, None)
+        if label_id is None:
+            return
+        self.by_length[len(label)].remove(label_id)
+        for gram, count in self._grams(label).items():
+            posting = self.postings[gram]
+            posting.remove((label_id, count))
+            if not posting:
+                del self.postings[gram]
+
+    def shared_counts(self, token: str) -> Dict[int, int]:
+        """label id -> number of trigrams (multiset) shared with token."""
+        shared: Dict[int, int] = {}
+        for gram, count in self._grams(token).items():
+            for label_id, label_count in self.postings.get(gram, ()):
+                shared[label_id] = shared.get(label_id, 0) + min(count, label_count)
+        return shared
+
+    def within(self, token: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Every (distance, label) with distance <= max_distance, unsorted."""
+        n = len(token)
+        shared = self.shared_counts(token)
+        matches = []
+        for length in range(max(0, n - max_distance), n + max_distance + 1):
+            threshold = max(n, length) + 2 - 3 * max_distance
+            for label_id in self.by_length.get(length, ()):
+                if threshold > 0 and shared.get(label_id, 0) < threshold:
+                    continue
+                label = self.labels[label_id]
+                dist = levenshtein_within(token, label, max_distance)
+                if dist <= max_distance:
+                    matches.append((dist, label))
+        return matches
+
+    def closest(self, token: str, max_distance: int) -> Optional[Tuple[str, int]]:
+        """Same contract as BKTree.closest."""
+        if token in self.ids:
+            return token, 0
+        matches = self.within(token, max_distance)
+        if not matches:
+            return None
+        dist, label = min(matches)
+        return label, dist
+
+    def ranked_candidates(self, token: str, limit: int) -> List[str]:
+        """Up to limit labels sharing the most trigrams with token."""
+        shared = self.shared_counts(token)
+        ranked = sorted(shared.items(), key=lambda item: (-item[1], self.labels[item[0]]))
+        return [self.labels[label_id] for label_id, _ in ranked[:limit]]
+
+    def memory_bytes(self) -> int:
+        total = sys.getsizeof(self.labels) + sys.getsizeof(self.ids) + sys.getsizeof(self.postings)
+        for gram, posting in self.postings.items():
+            total += sys.getsizeof(gram) + sys.getsizeof(posting)
+            total += sum(sys.getsizeof(entry) for entry in posting)
+        return total
+
+
+class LabelTrie:
+    """
+    Character trie over labels, searched with a shared Levenshtein DP.
+
+    Walking down the trie appends one DP row per character, so labels with
+    a common prefix ("5-meo-", "2c-", "4-fluoro") share the rows for that
+    prefix instead of recomputing them per label. A whole subtree is pruned
+    as soon as the smallest value in its row exceeds the search radius,
+    since every label below it is at least that far from the token. Rows
+    are only computed on the diagonal band that can stay within radius.
+    Each node is [children: {char: node}, label_or_None].
+    """
+
+    name = "trie"
+    include_aliases = False
+
+    def __init__(self, labels: Iterable[str] = ()) -> None:
+        self.root: list = [{}, None]
+        self.labels: Set[str] = set()
+        for label in labels:
+            self.add(label)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def add(self, label: str) -> None:
+        if label in self.labels:
+            return
+        self.labels.add(label)
+        node = self.root
+        for c in label:
+            child = node[0].get(c)
+            if child is None:
+                child = [{}, None]
+                node[0][c] = child
+            node = child
+        node[1] = label
+
+    def discard(self, label: str) -> None:
+        if label not in self.labels:
+            return
+        self.labels.discard(label)
+        path = [self.root]
+        for c in label:
+            path.append(path[-1][0][c])
+        path[-1][1] = None
+        # prune the branch back to the last node still in use
+        for i in range(len(label), 0, -1):
+            node = path[i]
+            if node[0] or node[1] is not None:
+                break
+            del path[i - 1][0][label[i - 1]]
+
+    def closest(self, token: str, max_distance: int) -> Optional[Tuple[str, int]]:
+        """Same contract as BKTree.closest."""
+        if token in self.labels:
+            return token, 0
+
+        # Only the diagonal band |i - depth| <= max_distance can stay within
+        # max_distance, so rows are computed on that band and capped at big.
+        n = len(token)
+        k = max_distance
+        big = k + 1
+        best_label = None
+        best_distance = k
+        stack = [(self.root, 0, [i if i <= k else big for i in range(n + 1)], 0)]
+        while stack:
+            node, depth, previous, previous_min = stack.pop()
+            if previous_min > best_distance:
+                # radius shrank since this subtree was queued
+                continue
+            j = depth + 1
+            lo = max(1, j - k)
+            hi = min(n, j + k)
+            expand = []
+            for c, child in node[0].items():
+                current = [big] * (n + 1)
+                current[0] = j if j <= k else big
+                row_min = current[0]
+                for i in range(lo, hi + 1):
+                    cost = previous[i - 1] + (token[i - 1] != c)
+                    if previous[i] + 1 < cost:
+                        cost = previous[i] + 1
+                    if current[i - 1] + 1 < cost:
+                        cost = current[i - 1] + 1
+                    if cost > big:
+                        cost = big
+                    current[i] = cost
+                    if cost < row_min:
+                        row_min = cost
+
+                label = child[1]
+                if label is not None:
+                    dist = current[n]
+                    if dist < best_distance or (
+                        dist == best_distance and (best_label is None or label < best_label)
+                    ):
+                        best_label, best_distance = label, dist
+
+                if child[0] and row_min <= best_distance:
+                    expand.append((row_min, child, current))
+
+            # most promising child last, so it is popped first and tightens
+            # the radius for its siblings
+            expand.sort(key=lambda item: -item[0])
+            for row_min, child, current in expand:
+                stack.append((child, j, current, row_min))
+
+        if best_label is None:
+            return None
+        return best_label, best_distance
+
+    def memory_bytes(self) -> int:
+        total = sys.getsizeof(self.labels)
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            total += sys.getsizeof(node) + sys.getsizeof(node[0])
+            stack.extend(node[0].values())
+        return total
+
+
+class LengthShardedIndex:
+    """
+    Labels bucketed by length. A label whose length differs from the
+    token's by more than k cannot be within distance k, so a lookup only
+    scans the 2k + 1 buckets around the token length - and with the
+    per-length distance budget, short tokens only scan their own bucket.
+    """
+
+    name = "length"
+    include_aliases = False
+
+    def __init__(self, labels: Iterable[str] = ()) -> None:
+        self.shards: Dict[int, List[str]] = {}
+        self.labels: Set[str] = set()
+        for label in labels:
+            self.add(label)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def add(self, label: str) -> None:
+        if label in self.labels:
+            return
+        self.labels.add(label)
+        bisect.insort(self.shards.setdefault(len(label), []), label)
+
+    def discard(self, label: str) -> None:
+        if label not in self.labels:
+            return
+        self.labels.discard(label)
+        shard = self.shards[len(label)]
+        del shard[bisect.bisect_left(shard, label)]
+
+    def closest(self, token: str, max_distance: int) -> Optional[Tuple[str, int]]:
+        """Same contract as BKTree.closest."""
+        if token in self.labels:
+            return token, 0
+
+        n = len(token)
+        best = None
+        for length in range(max(0, n - max_distance), n + max_distance + 1):
+            for label in self.shards.get(length, ()):
+                bound = max_distance if best is None else best[0]
+                dist = levenshtein_within(token, label, bound)
+                if dist <= bound and (best is None or (dist, label) < best):
+                    best = (dist, label)
+
+        if best is None:
+            return None
+        return best[1], best[0]
+
+    def memory_bytes(self) -> int:
+        total = sys.getsizeof(self.labels) + sys.getsizeof(self.shards)
+        for shard in self.shards.values():
+            total += sys.getsizeof(shard) + sum(sys.getsizeof(label) for label in shard)
+        return total
+
+
+# Selectable fuzzy engines (see initialise_drug_config(fuzzy_engine=...))
+FUZZY_ENGINES: Dict[str, type] = {
+    "bktree": BKTree,
+    "symspell": SymSpellIndex,
+    "numpy": NumpyLabelMatrix,
+    "trigram": TrigramIndex,
+    "trie": LabelTrie,
+    "length": LengthShardedIndex,
+}
+# Default engine: trigram candidates verified with levenshtein_within answer
+# a lookup about 10x faster than the BK-tree, which visits ~20% of labels
+# at distance 2 on this label set
+FUZZY_ENGINE: str = "trigram"
+
+# Per-length fuzzy distance budget: (max_token_length, max_distance) pairs,
+# checked in order; longer tokens get FUZZY_MAX_DISTANCE. Short slang is
+# never "corrected" to an unrelated short label.
+FUZZY_DISTANCE_BUDGET: List[Tuple[int, int]] = [(3, 0), (6, 1)]
+FUZZY_MAX_DISTANCE: int = 2
+
+
+def fuzzy_distance_budget(token: str) -> int:
+    """Maximum edit distance allowed when fuzzy-correcting this token."""
+    for max_length, budget in FUZZY_DISTANCE_BUDGET:
+        if len(token) <= max_length:
+            return budget
+    return FUZZY_MAX_DISTANCE
+
+# Index over all known labels (built by initialise_drug_config)
+FUZZY_INDEX = None
+FUZZY_INDEX_STATS: Dict[str, object] = {}
+
+
+def rebuild_fuzzy_index() -> None:
+    """
+    Rebuild FUZZY_INDEX with the current FUZZY_ENGINE from all labels in
+    BASE_DRUG_CONFIG and DRUG_CONFIG (plus alias/slang/phrase keys for
+    engines that index them), and record build stats in FUZZY_INDEX_STATS.
+    """
+    global FUZZY_INDEX, FUZZY_INDEX_STATS
+    engine = FUZZY_ENGINES[FUZZY_ENGINE]
+
+    labels = set(BASE_DRUG_CONFIG) | set(DRUG_CONFIG)
+    if engine.include_aliases:
+        labels |= set(NORMALISATION_MAP) | set(SLANG_MAP) | set(PHRASE_NORMALISATION)
+
+    start = time.perf_counter()
+    # sorted so the index does not depend on set iteration order
+    FUZZY_INDEX = engine(sorted(labels))
+    build_seconds = time.perf_counter() - start
+
+    FUZZY_INDEX_STATS = {
+        "engine": engine.name,
+        "labels": len(FUZZY_INDEX),
+        "build_seconds": build_seconds,
+        "memory_bytes": FUZZY_INDEX.memory_bytes(),
+    }
+    bump_config_version()
+
+
+def index_drug_label(name: str) -> None:
+    """Keep FUZZY_INDEX in sync when a new label is added to DRUG_CONFIG."""
+    global LABEL_GENERATION, TAGGING_VERSION
+    # a new label can change fuzzy corrections, but never exact hits
+    LABEL_GENERATION += 1
+    if FUZZY_INDEX is not None:
+        FUZZY_INDEX.add(name)
+    if DRUG_CONFIG.get(name, {}).get("category") != "unknown":
+        # known labels join the token trie and fold keys ("synthe tic")
+        TAGGING_VERSION += 1
+        if PHONETIC_INDEX is not None:
+            _add_phonetic_label(name)
+        if FOLD_INDEX is not None:
+            _add_fold_label(name)
+
+
+def index_alias_label(alias: str) -> None:
+    """Same as index_drug_label, for alias/slang/phrase keys."""
+    global ALIAS_GENERATION
+    # the token trie is keyed on it (see get_token_trie)
+    ALIAS_GENERATION += 1
+    if FUZZY_INDEX is not None and FUZZY_INDEX.include_aliases:
+        FUZZY_INDEX.add(alias)
+    if SUGGEST_INDEX is not None:
+        SUGGEST_INDEX.add(alias)
+    if PHONETIC_INDEX is not None and (alias in SLANG_MAP or alias in NORMALISATION_MAP):
+        _add_phonetic_label(alias)
+    if FOLD_INDEX is not None:
+        _add_fold_label(alias)
+
+
+def fuzzy_closest(token: str, max_distance: Optional[int] = None) -> Optional[Tuple[str, int]]:
+    """
+    (canonical_name, distance) for the closest known label within
+    max_distance (default: the token's fuzzy_distance_budget), or None.
+    Alias labels are mapped to their canonical name.
+    """
+    token = token.lower().strip()
+    if max_distance is None:
+        max_distance = fuzzy_distance_budget(token)
+    if FUZZY_INDEX is None:
+        rebuild_fuzzy_index()
+
+    match = FUZZY_INDEX.closest(token, max_distance)
+    if match is None:
+        return None
+    return _canonical_fuzzy_label(match[0]), match[1]
+
+
+def fuzzy_lookup(token: str, max_distance: Optional[int] = None) -> str:
+    """
+    Index-backed equivalent of fuzzy_match_drug over all known labels.
+    Returns the closest label within max_distance (mapped to its canonical
+    name if it is an alias), or the token itself.
+    """
+    match = fuzzy_closest(token, max_distance)
+    if match is None:
+        return token.lower().strip()
+    return match[0]
+
+
+def fuzzy_closest_many(
+    tokens: List[str], max_distance: Optional[int] = None
+) -> List[Optional[Tuple[str, int]]]:
+    """
+    fuzzy_closest for a batch of tokens. Engines with a closest_many method
+    (e.g. "numpy") resolve the batch in vectorised blocks, one group per
+    distance budget.
+    """
+    tokens = [t.lower().strip() for t in tokens]
+    if FUZZY_INDEX is None:
+        rebuild_fuzzy_index()
+
+    groups: Dict[int, List[int]] = {}
+    for pos, token in enumerate(tokens):
+        k = fuzzy_distance_budget(token) if max_distance is None else max_distance
+        groups.setdefault(k, []).append(pos)
+
+    results: List[Optional[Tuple[str, int]]] = [None] * len(tokens)
+    closest_many = getattr(FUZZY_INDEX, "closest_many", None)
+    for k, positions in groups.items():
+        group = [tokens[pos] for pos in positions]
+        if closest_many is not None:
+            matches = closest_many(group, k)
+        else:
+            matches = [FUZZY_INDEX.closest(t, k) for t in group]
+        for pos, match in zip(positions, matches):
+            if match is not None:
+                results[pos] = _canonical_fuzzy_label(match[0]), match[1]
+    return results
+
+
+def fuzzy_lookup_many(tokens: List[str], max_distance: Optional[int] = None) -> List[str]:
+    """fuzzy_lookup for a batch of tokens (see fuzzy_closest_many)."""
+    matches = fuzzy_closest_many(tokens, max_distance)
+    return [
+        token.lower().strip() if match is None else match[0]
+        for token, match in zip(tokens, matches)
+    ]
+
+
+# Trigram index over base/TripSit names and every alias, for suggest_drugs()
+SUGGEST_INDEX: Optional[TrigramIndex] = None
+
+
+def rebuild_suggest_index() -> None:
+    """
+    Rebuild SUGGEST_INDEX from BASE_DRUG_CONFIG, TripSit and registry names
+    and all alias maps.
+    """
+    global SUGGEST_INDEX
+    labels = (
+        set(BASE_DRUG_CONFIG)
+        | TRIPSIT_DRUG_NAMES
+        | REGISTRY_DRUG_NAMES
+        | set(SLANG_MAP)
+        | set(NORMALISATION_MAP)
+        | set(PHRASE_NORMALISATION)
+    )
+    SUGGEST_INDEX = TrigramIndex(sorted(labels))
+
+
+def _label_source(label: str) -> Tuple[str, str]:
+    """(canonical_name, source) for a label, following normalise_token's order."""
+    if label in SLANG_MAP:
+        return normalise_token(label), "slang"
+    if label in PHRASE_NORMALISATION:
+        return PHRASE_NORMALISATION[label], "alias"
+    if label in NORMALISATION_MAP:
+        return NORMALISATION_MAP[label], "alias"
+    if label in BASE_DRUG_CONFIG:
+        return label, "base"
+    if label in REGISTRY_DRUG_NAMES and label not in TRIPSIT_DRUG_NAMES:
+        return label, "registry"
+    return label, "tripsit"
+
+
+def suggest_drugs(
+    token: str, k: int = 5, max_distance: Optional[int] = None
+) -> List[Tuple[str, int, str]]:
+    """
+    "Did you mean" suggestions: up to k (canonical_name, distance, source)
+    tuples, closest first. source is one of 'slang', 'alias', 'base',
+    'tripsit' or 'registry'. With max_distance, every label within it is
+    considered; without, candidates are the labels sharing the most
+    trigrams with the token. Each canonical name is listed once, under its
+    best label.
+    """
+    token = token.lower().strip()
+    if SUGGEST_INDEX is None:
+        rebuild_suggest_index()
+
+    if max_distance is None:
+        scored = [
+            (levenshtein(token, label), label)
+            for label in SUGGEST_INDEX.ranked_candidates(token, limit=max(50, 10 * k))
+        ]
+    else:
+        scored = SUGGEST_INDEX.within(token, max_distance)
+    scored.sort()
+
+    suggestions: List[Tuple[str, int, str]] = []
+    seen: Set[str] = set()
+    for dist, label in scored:
+        canonical, source = _label_source(label)
+        if canonical in seen:
+            continue
+        seen.add(canonical)
+        suggestions.append((canonical, dist, source))
+        if len(suggestions) == k:
+            break
+    return suggestions
+
+
+def _canonical_fuzzy_label(label: str) -> str:
+    """Map a label returned by a fuzzy engine (possibly an alias) to its canonical name."""
+    if label in DRUG_CONFIG or label in BASE_DRUG_CONFIG:
+        return label
+    if label in PHRASE_NORMALISATION:
+        return PHRASE_NORMALISATION[label]
+    return normalise_token(label)
+
+
+# --- Phonetic keys ----------------------------------------------------------
+
+# Applied in order after lowercasing; digraphs before single letters
+_PHONETIC_REWRITES: List[Tuple[str, str]] = [
+    ("ph", "f"),
+    ("gh", ""),
+    ("ck", "k"),
+    ("qu", "kw"),
+    ("dg", "j"),
+    ("kn", "n"),
+    ("x", "ks"),
+    ("q", "k"),
+    ("z", "s"),
+    ("v", "f"),
+]
+_PHONETIC_SOFT_C = re.compile(r"c(?=[eiy])")
+_PHONETIC_MIN_KEY = 3
+
+
+def phonetic_key(word: str) -> str:
+    """
+    Metaphone-style consonant skeleton: 'ketamean' and 'ketamine' -> 'ktmn',
+    'zanax' and 'xanax' -> 'snks', 'fentanil' and 'fentanyl' -> 'fntnl'.
+    A leading vowel is kept as 'a'; later vowels, 'y' and non-initial 'h'
+    are dropped and repeated consonants collapsed.
+    """
+    w = re.sub(r"[^a-z]", "", word.lower())
+    if not w:
+        return ""
+    if w[0] == "x":
+        w = "s" + w[1:]
+    for old, new in _PHONETIC_REWRITES:
+        w = w.replace(old, new)
+    w = _PHONETIC_SOFT_C.sub("s", w).replace("c", "k")
+    if not w:
+        return ""
+
+    key = ["a" if w[0] in "aeiouy" else w[0]]
+    for ch in w[1:]:
+        if ch in "aeiouyh" or ch == key[-1]:
+            continue
+        key.append(ch)
+    return "".join(key)
+
+
+# Phonetic matches on long tokens may be one edit further than fuzzy ones
+# ("ketamean" -> ketamine is 3 edits but the same key)
+PHONETIC_MAX_DISTANCE: int = 3
+
+# phonetic key -> labels (DRUG_CONFIG, SLANG_MAP and NORMALISATION_MAP keys)
+PHONETIC_INDEX: Optional[Dict[str, List[str]]] = None
+
+
+def _add_phonetic_label(label: str) -> None:
+    key = phonetic_key(label)
+    if len(key) < _PHONETIC_MIN_KEY:
+        return
+    bucket = PHONETIC_INDEX.setdefault(key, [])
+    if label not in bucket:
+        bucket.append(label)
+
+
+def _discard_phonetic_label(label: str) -> None:
+    key = phonetic_key(label)
+    bucket = PHONETIC_INDEX.get(key)
+    if bucket and label in bucket:
+        bucket.remove(label)
+        if not bucket:
+            del PHONETIC_INDEX[key]
+
+
+def rebuild_phonetic_index() -> None:
+    """Rebuild PHONETIC_INDEX from DRUG_CONFIG, SLANG_MAP and NORMALISATION_MAP."""
+    global PHONETIC_INDEX
+    PHONETIC_INDEX = {}
+    labels = {name for name, info in DRUG_CONFIG.items() if info["category"] != "unknown"}
+    labels |= set(BASE_DRUG_CONFIG) | set(SLANG_MAP) | set(NORMALISATION_MAP)
+    for label in sorted(labels):
+        _add_phonetic_label(label)
+
+
+def phonetic_distance_budget(token: str) -> int:
+    """
+    Maximum edit distance for a phonetic match: the fuzzy budget, widened
+    to PHONETIC_MAX_DISTANCE for tokens long enough to get FUZZY_MAX_DISTANCE.
+    """
+    budget = fuzzy_distance_budget(token)
+    return PHONETIC_MAX_DISTANCE if budget >= FUZZY_MAX_DISTANCE else budget
+
+
+def phonetic_lookup(token: str) -> Optional[Tuple[str, int]]:
+    """
+    (canonical_name, distance) for a token whose phonetic key matches a
+    known label, or None. Several labels can share a key; the closest one by edit
+    distance wins, and it must be within phonetic_distance_budget(token) so
+    that ordinary words with a similar skeleton ("open", "music") are not
+    rewritten. Callers try the exact, alias, slang, folded and fuzzy lookups
+    first, so a closer fuzzy match always wins.
+    """
+    if len(token) < 4:
+        return None
+    if PHONETIC_INDEX is None:
+        rebuild_phonetic_index()
+
+    labels = PHONETIC_INDEX.get(phonetic_key(token))
+    if not labels:
+        return None
+
+    bound = phonetic_distance_budget(token)
+    best = None
+    for label in labels:
+        dist = levenshtein_within(token, label, bound)
+        if dist <= bound and (best is None or (dist, label) < best):
+            best = (dist, label)
+    if best is None:
+        return None
+    return _canonical_fuzzy_label(best[1]), best[0]
+
+
+# --- Folded keys ------------------------------------------------------------
+
+# Hyphens and dashes (after NFKC), spaces and underscores are dropped, so
+# "5F–ADB", "5f adb" and "5f_adb" all fold to "5fadb".
+_FOLD_DROP = dict.fromkeys(map(ord, "-_ \u2010\u2011\u2012\u2013\u2014\u2015\u2212"), None)
+
+# Longest run of tokens joined into one folded key ("mdmb 4en pinaca")
+FOLD_MAX_TOKENS = 3
+
+# Clock and duration words never join into a key ("at 6 am" is not 6-AM)
+FOLD_TIME_WORDS = frozenset({
+    "am", "pm", "hr", "hrs", "hour", "hours", "min", "mins", "minute",
+    "minutes", "sec", "secs", "second", "seconds", "day", "days", "week",
+    "weeks", "month", "months", "ago",
+})
+
+
+@lru_cache(maxsize=65536)
+def fold_label(text: str) -> str:
+    """Canonical spelling-insensitive key: NFKC, lowercase, no dashes/spaces/underscores."""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKC", text)
+    return text.lower().translate(_FOLD_DROP)
+
+
+# folded key -> canonical name, and every proper prefix of a key (so the
+# tokeniser only tries joining tokens that can lead to a key)
+FOLD_INDEX: Optional[Dict[str, str]] = None
+_FOLD_PREFIXES: Set[str] = set()
+
+
+def _add_fold_label(label: str) -> None:
+    key = fold_label(label)
+    if not key or key in FOLD_INDEX:
+        return
+    FOLD_INDEX[key] = _canonical_fuzzy_label(label)
+    for i in range(1, len(key)):
+        _FOLD_PREFIXES.add(key[:i])
+
+
+def rebuild_fold_index() -> None:
+    """
+    Rebuild FOLD_INDEX from DRUG_CONFIG (known categories), BASE_DRUG_CONFIG
+    and the alias/slang/phrase keys. When labels share a key, one that is
+    already folded wins (the "2cb" alias over "2-cb"), then the lowest.
+    """
+    global FOLD_INDEX
+    FOLD_INDEX = {}
+    _FOLD_PREFIXES.clear()
+    for label in sorted(_fold_labels(), key=_fold_rank):
+        _add_fold_label(label)
+
+
+def _fold_labels() -> Set[str]:
+    labels = {name for name, info in DRUG_CONFIG.items() if info["category"] != "unknown"}
+    labels |= set(BASE_DRUG_CONFIG) | set(SLANG_MAP) | set(NORMALISATION_MAP)
+    labels |= set(PHRASE_NORMALISATION)
+    return labels
+
+
+def _fold_rank(label: str) -> Tuple[bool, str]:
+    return fold_label(label) != label, label
+
+
+def refresh_fold_keys(labels: Iterable[str]) -> None:
+    """
+    Recompute the FOLD_INDEX entries for the folded keys of labels after
+    they were added, removed or re-pointed, with rebuild_fold_index's
+    tie-break. Prefixes of dropped keys stay in _FOLD_PREFIXES; they only
+    make the tokeniser try a join that then finds no key.
+    """
+    if FOLD_INDEX is None:
+        return
+    keys = {fold_label(label) for label in labels}
+    keys.discard("")
+    best: Dict[str, str] = {}
+    for label in _fold_labels():
+        key = fold_label(label)
+        if key in keys and (key not in best or _fold_rank(label) < _fold_rank(best[key])):
+            best[key] = label
+    for key in keys:
+        FOLD_INDEX.pop(key, None)
+        if key in best:
+            _add_fold_label(best[key])
+
+
+def fold_lookup(token: str) -> Optional[str]:
+    """Canonical name whose folded key equals the token's, or None."""
+    if FOLD_INDEX is None:
+        rebuild_fold_index()
+    return FOLD_INDEX.get(fold_label(token))
+
+
+# =============================================================================
+# 4b. TOKEN RESOLUTION CACHE
+# =============================================================================
+
+# Bumped whenever DRUG_CONFIG, the alias maps or the fuzzy index change
+# (initialise_drug_config, ingest_drug_record, the alias builders).
+CONFIG_VERSION: int = 0
+
+# Bumped whenever a new label is indexed; only fuzzy corrections depend on it.
+LABEL_GENERATION: int = 0
+
+# Bumped when apply_tripsit_update changes which labels exist, or a label
+# with a known category is indexed; the token trie and IncrementalExtractor's
+# tagging depend on it (as well as on CONFIG_VERSION), cached resolutions
+# do not.
+TAGGING_VERSION: int = 0
+
+# Bumped whenever an alias, slang or phrase key is indexed; tagging depends
+# on it the same way it depends on TAGGING_VERSION.
+ALIAS_GENERATION: int = 0
+
+# raw token -> ((canonical, category, score, is_unknown, path), version, generation)
+TOKEN_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+TOKEN_CACHE_MAXSIZE: int = 4096
+TOKEN_CACHE_STATS: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+# Triages resolve tokens under KB_LOCK's read side, and resolving writes:
+# the TOKEN_CACHE LRU order, DRUG_CONFIG entries for inferred labels and
+# the indexes index_drug_label extends. resolve_drug_token holds
+# RESOLVE_LOCK so concurrent triages never see those half-updated.
+RESOLVE_LOCK = threading.RLock()
+
+# How tokens were resolved (see resolve_drug_token), counted per call
+RESOLUTION_PATHS = ("exact", "slang", "alias", "folded", "phonetic", "fuzzy", "inferred")
+RESOLUTION_PATH_COUNTS: Dict[str, int] = {path: 0 for path in RESOLUTION_PATHS}
+
+
+class TokenResolution(NamedTuple):
+    """get_drug_info's tuple plus how the token was resolved."""
+    canonical: str
+    category: str
+    score: int
+    is_unknown: bool
+    path: str
+    distance: Optional[int]  # edit distance of the correction; None if nothing matched
+    budget: int              # fuzzy distance budget for this token's length
+
+
+def bump_config_version() -> None:
+    """
+    Invalidate all cached token resolutions. Call this after editing
+    DRUG_CONFIG, SLANG_MAP, NORMALISATION_MAP etc. by hand.
+    """
+    global CONFIG_VERSION
+    CONFIG_VERSION += 1
+
+
+# LABEL_GENERATION -> labels whose cached resolutions were dropped when it
+# started (see invalidate_labels)
+INVALIDATED_LABELS: Dict[int, frozenset] = {}
+
+
+def invalidate_labels(labels: Iterable[str]) -> int:
+    """
+    Drop the cached resolutions of tokens that are, or resolved to, one of
+    labels, and start a new LABEL_GENERATION so cached corrections are
+    re-checked. The rest of TOKEN_CACHE stays valid. Returns the number
+    of entries dropped.
+    """
+    global LABEL_GENERATION
+    labels = frozenset(labels)
+    LABEL_GENERATION += 1
+    INVALIDATED_LABELS[LABEL_GENERATION] = labels
+    stale = [
+        raw for raw, (result, _, _) in TOKEN_CACHE.items()
+        if result.canonical in labels or raw.lower().strip() in labels
+    ]
+    for raw in stale:
+        del TOKEN_CACHE[raw]
+    return len(stale)
+
+
+def labels_invalidated_since(generation: int) -> Set[str]:
+    """Union of the invalidate_labels calls after LABEL_GENERATION generation."""
+    out: Set[str] = set()
+    for gen, labels in INVALIDATED_LABELS.items():
+        if gen > generation:
+            out |= labels
+    return out
+
+
+def clear_token_cache() -> None:
+    """Drop all cached token resolutions and reset the counters."""
+    TOKEN_CACHE.clear()
+    for key in TOKEN_CACHE_STATS:
+        TOKEN_CACHE_STATS[key] = 0
+    for key in RESOLUTION_PATH_COUNTS:
+        RESOLUTION_PATH_COUNTS[key] = 0
+
+
+def token_cache_info() -> Dict[str, int]:
+    """Hit/miss/eviction counters plus current size and config version."""
+    info = dict(TOKEN_CACHE_STATS)
+    info["size"] = len(TOKEN_CACHE)
+    info["maxsize"] = TOKEN_CACHE_MAXSIZE
+    info["config_version"] = CONFIG_VERSION
+    return info
+
 
 def get_drug_info(raw_token: str) -> Tuple[str, str, int, bool]:
     """
@@ -578,17 +2959,160 @@ def get_drug_info(raw_token: str) -> Tuple[str, str, int, bool]:
         treated as known, unless its category is literally 'unknown'.
       - Only new / inferred substances with category 'unknown' are returned
         as unknowns.
+
+    Results are memoised in TOKEN_CACHE (see section 4b).
+    """
+    return resolve_drug_token(raw_token)[:4]
+
+
+def resolve_drug_token(raw_token: str) -> TokenResolution:
+    """
+    Same as get_drug_info, as a TokenResolution that also records the
+    correction distance, the distance budget and the path that resolved
+    the token:
+      'exact'    - already a known label
+      'slang'    - via SLANG_MAP
+      'alias'    - via NORMALISATION_MAP
+      'folded'   - via FOLD_INDEX (dash/space/underscore/Unicode variants)
+      'phonetic' - via the phonetic key index
+      'fuzzy'    - via edit-distance correction
+      'inferred' - new substance, category inferred from the name
+    """
+    with RESOLVE_LOCK:
+        return _resolve_drug_token(raw_token)
+
+
+def _cached_resolution(raw_token: str) -> Optional[TokenResolution]:
+    """The still-valid TOKEN_CACHE entry for raw_token, or None."""
+    cached = TOKEN_CACHE.get(raw_token)
+    if cached is None:
+        return None
+    result, version, generation = cached
+    if version == CONFIG_VERSION and (generation is None or generation == LABEL_GENERATION):
+        return result
+    return None
+
+
+def resolve_drug_tokens(raw_tokens: Iterable[str]) -> Dict[str, TokenResolution]:
     """
+    resolve_drug_token for each distinct token, in order of first
+    appearance, with the same results. Tokens that reach the fuzzy stage
+    are looked up together in one fuzzy_closest_many call first, so
+    engines with closest_many (e.g. "numpy") vectorise them.
+    """
+    with RESOLVE_LOCK:
+        raws = list(dict.fromkeys(raw_tokens))
+        pending = []
+        for raw in raws:
+            if _cached_resolution(raw) is None:
+                token = normalise_token(raw)
+                if (
+                    token not in BASE_DRUG_CONFIG
+                    and token not in DRUG_CONFIG
+                    and fold_lookup(token) is None
+                ):
+                    pending.append(token)
+        pending = list(dict.fromkeys(pending))
+        hints = dict(zip(pending, fuzzy_closest_many(pending)))
+
+        resolved: Dict[str, TokenResolution] = {}
+        added: List[str] = []  # labels inferred (and indexed) since the hints
+        for raw in raws:
+            result = _resolve_drug_token(raw, hints, added)
+            if result.path == "inferred":
+                added.append(result.canonical)
+            resolved[raw] = result
+        return resolved
+
+
+def _hinted_fuzzy_closest(
+    token: str, budget: int, hint: Optional[Tuple[str, int]], added: List[str]
+) -> Optional[Tuple[str, int]]:
+    """
+    fuzzy_closest(token, budget), given hint, its result before the labels
+    in added were indexed: only looked up again if one of them is in range.
+    """
+    for label in added:
+        if levenshtein_within(token, label, budget) <= budget:
+            return fuzzy_closest(token, budget)
+    return hint
+
+
+def _resolve_drug_token(
+    raw_token: str,
+    fuzzy_hints: Optional[Dict[str, Optional[Tuple[str, int]]]] = None,
+    added: Optional[List[str]] = None,
+) -> TokenResolution:
+    """resolve_drug_token without RESOLVE_LOCK (hints: see resolve_drug_tokens)."""
+    result = _cached_resolution(raw_token)
+    if result is not None:
+        TOKEN_CACHE.move_to_end(raw_token)
+        TOKEN_CACHE_STATS["hits"] += 1
+        RESOLUTION_PATH_COUNTS[result.path] += 1
+        return result
+    TOKEN_CACHE_STATS["misses"] += 1
+
     # 1) Normalise slang / variants
+    lowered = raw_token.lower().strip()
     token = normalise_token(raw_token)
-
-    # 2) Fuzzy match against ALL known labels (base + current config)
-    known_labels = set(BASE_DRUG_CONFIG.keys()) | set(DRUG_CONFIG.keys())
-    token = fuzzy_match_drug(token, list(known_labels))
+    if lowered in SLANG_MAP:
+        path = "slang"
+    elif token != lowered:
+        path = "alias"
+    else:
+        path = "exact"
+
+    result = _resolve_normalised_token(token, path, fuzzy_hints, added)
+
+    # Exact hits (including brand-new labels just added to DRUG_CONFIG) can
+    # only change with the config; phonetic/fuzzy corrections also depend
+    # on which other labels exist, so tie them to LABEL_GENERATION.
+    generation = None if result.canonical == token else LABEL_GENERATION
+    TOKEN_CACHE[raw_token] = (result, CONFIG_VERSION, generation)
+    TOKEN_CACHE.move_to_end(raw_token)
+    if len(TOKEN_CACHE) > TOKEN_CACHE_MAXSIZE:
+        TOKEN_CACHE.popitem(last=False)
+        TOKEN_CACHE_STATS["evictions"] += 1
+
+    RESOLUTION_PATH_COUNTS[result.path] += 1
+    return result
+
+
+def _resolve_normalised_token(
+    token: str,
+    path: str,
+    fuzzy_hints: Optional[Dict[str, Optional[Tuple[str, int]]]] = None,
+    added: Optional[List[str]] = None,
+) -> TokenResolution:
+    """Uncached body of resolve_drug_token, starting from a normalised token."""
+    budget = fuzzy_distance_budget(token)
+    distance: Optional[int] = 0
+
+    # 2) O(1) folded-key lookup, fuzzy match against ALL known labels, then
+    #    the phonetic stage for spellings just past the fuzzy budget
+    if token not in BASE_DRUG_CONFIG and token not in DRUG_CONFIG:
+        folded = fold_lookup(token)
+        if folded is not None:
+            token, path = folded, "folded"
+        else:
+            if fuzzy_hints is not None and token in fuzzy_hints:
+                match = _hinted_fuzzy_closest(token, budget, fuzzy_hints[token], added or [])
+            else:
+                match = fuzzy_closest(token, budget)
+            path = "fuzzy"
+            if match is None:
+                match = phonetic_lookup(token)
+                path = "phonetic"
+            if match is not None:
+                token, distance = match
+            else:
+                path = "inferred"
+                distance = None
 
     # --- A. ALWAYS-KNOWN: base Bristol set ---------------------------------
     if token in BASE_DRUG_CONFIG:
-        base_info = BASE_DRUG_CONFIG[token]
+        # DRUG_CONFIG carries the TripSit-merged (max) score
+        base_info = DRUG_CONFIG.get(token) or BASE_DRUG_CONFIG[token]
         cat = str(base_info["category"])
         score = int(base_info["score"])
 
@@ -597,7 +3121,7 @@ def get_drug_info(raw_token: str) -> Tuple[str, str, int, bool]:
             DRUG_CONFIG[token] = {"category": cat, "score": score}
 
         # Base drugs can NEVER be 'unknown'
-        return token, cat, score, False
+        return TokenResolution(token, cat, score, False, path, distance, budget)
 
     # --- B. Known from TripSit / previous inference ------------------------
     if token in DRUG_CONFIG:
@@ -606,7 +3130,7 @@ def get_drug_info(raw_token: str) -> Tuple[str, str, int, bool]:
         score = int(info["score"])
         # Only treat as unknown if its stored category is literally 'unknown'
         is_unknown = (cat == "unknown")
-        return token, cat, score, is_unknown
+        return TokenResolution(token, cat, score, is_unknown, path, distance, budget)
 
     # --- C. Completely new substance: infer on the fly ---------------------
     inferred_cat = infer_category_from_name(token)
@@ -615,9 +3139,10 @@ def get_drug_info(raw_token: str) -> Tuple[str, str, int, bool]:
 
     score = CATEGORY_DEFAULT_SCORE[inferred_cat]
     DRUG_CONFIG[token] = {"category": inferred_cat, "score": score}
+    index_drug_label(token)
     is_unknown = (inferred_cat == "unknown")
 
-    return token, inferred_cat, score, is_unknown
+    return TokenResolution(token, inferred_cat, score, is_unknown, "inferred", None, budget)
 
 # =============================================================================
 # 5. CATEGORY-LEVEL SYNERGY RULES
@@ -825,33 +3350,590 @@ PHRASE_NORMALISATION = {
     "cyrstal meth": "methamphetamine",
 }
 
-def extract_drugs(text: str) -> Tuple[List[str], List[str]]:
+# The alias maps as defined above, before TripSit aliases are merged in;
+# initialise_drug_config starts from these and snapshots hash them.
+_PRISTINE_NORMALISATION_MAP: Dict[str, str] = dict(NORMALISATION_MAP)
+_PRISTINE_PHRASE_NORMALISATION: Dict[str, str] = dict(PHRASE_NORMALISATION)
+
+
+# Common non-drug vocabulary (see non_drug_words.txt); tokens found here are
+# skipped before any fuzzy matching instead of becoming 'unknown' drugs
+NON_DRUG_WORDS: frozenset = frozenset()
+# The full word list, before known labels were removed from it
+NON_DRUG_LEXICON: frozenset = frozenset()
+NON_DRUG_STATS: Dict[str, int] = {"short_circuited": 0}
+
+# Punctuation ignored when checking a token against NON_DRUG_WORDS
+_NON_DRUG_STRIP = ".!?:()[]\"'"
+
+
+def load_non_drug_lexicon(path: str) -> None:
     """
-    Parse free text and return:
-      - list of canonical drugs,
-      - list of 'unknown category' drugs.
-      STOPWORDS (e.g. 'and', 'with') are ignored.
+    Load the non-drug word list (one word per line, '#' comments) into
+    NON_DRUG_WORDS. Words that are also a drug label, slang term or alias
+    are dropped, so the list can never hide a real detection.
     """
-    text = text.lower()
+    global NON_DRUG_WORDS, NON_DRUG_LEXICON
 
-    # Apply phrase normalisation BEFORE splitting
-    for phrase, replacement in PHRASE_NORMALISATION.items():
-        text = text.replace(phrase, replacement)
+    with open(path, "r", encoding="utf-8") as f:
+        words = {
+            line.split("#", 1)[0].strip().lower()
+            for line in f
+        }
+    words.discard("")
+    NON_DRUG_LEXICON = frozenset(words)
+
+    known = (
+        set(BASE_DRUG_CONFIG)
+        | set(DRUG_CONFIG)
+        | set(SLANG_MAP)
+        | set(NORMALISATION_MAP)
+        | set(PHRASE_NORMALISATION)
+    )
+    NON_DRUG_WORDS = frozenset(words - known)
 
-    tokens = re.split(r"[ ,;\n]+", text)
 
-    detected: List[str] = []
-    unknowns: List[str] = []
+def is_non_drug_word(token: str) -> bool:
+    """True if the token (ignoring surrounding punctuation) is in NON_DRUG_WORDS."""
+    return token.strip(_NON_DRUG_STRIP) in NON_DRUG_WORDS
+
+
+# Tokens are runs of non-separator characters; trailing sentence punctuation
+# is not part of the token ("ket." -> "ket"). Used for input text and to
+# split multi-word labels.
+_TOKEN_PATTERN = re.compile(r"[^\s,;]*[^\s,;.!?:]")
+_TOKEN_SEPARATORS = ",;"
+_STREAM_CHUNK_SIZE = 65536
+_MAX_TOKEN_CHARS = 1024
+
+
+def _last_separator(buf: str, end: Optional[int] = None) -> int:
+    """Index of the last separator character in buf[:end], or -1."""
+    for i in range((len(buf) if end is None else end) - 1, -1, -1):
+        if buf[i].isspace() or buf[i] in _TOKEN_SEPARATORS:
+            return i
+    return -1
+
+
+def iter_tokens(
+    source: Union[str, Iterable[str]], chunk_size: int = _STREAM_CHUNK_SIZE
+) -> Iterator[Tuple[str, int, int]]:
+    """
+    Lazily yield (token, start, end) with tokens lowercased and offsets
+    into the original text. source may be a string, an iterable of text
+    chunks, or a file object (read chunk_size characters at a time). Only
+    the unfinished last token of each chunk is carried over, so memory is
+    bounded by the chunk, not the note.
+    """
+    if isinstance(source, str):
+        for m in _TOKEN_PATTERN.finditer(source):
+            yield m.group().lower(), m.start(), m.end()
+        return
+
+    if hasattr(source, "read"):
+        chunks = iter(lambda: source.read(chunk_size), "")
+    else:
+        chunks = iter(source)
+
+    carry = ""
+    offset = 0  # position of carry[0] in the full text
+    for chunk in chunks:
+        buf = carry + chunk
+        # the text after the last separator may continue in the next chunk
+        cut = _last_separator(buf) + 1
+        if cut == 0:
+            if len(buf) <= _MAX_TOKEN_CHARS:
+                carry = buf
+                continue
+            cut = len(buf)
+        for m in _TOKEN_PATTERN.finditer(buf, 0, cut):
+            yield m.group().lower(), offset + m.start(), offset + m.end()
+        carry = buf[cut:]
+        offset += cut
+
+    for m in _TOKEN_PATTERN.finditer(carry):
+        yield m.group().lower(), offset + m.start(), offset + m.end()
+
+
+def split_tokens(text: str) -> List[str]:
+    """Tokenise text the way extract_drugs does."""
+    return [token for token, _, _ in iter_tokens(text)]
+
 
-    for token in tokens:
-        # Clean whitespace + hidden characters in one go
-        token = token.strip().replace("\r", "").replace("\n", "")
+class Quantity(NamedTuple):
+    """
+    A dose, count, route, frequency, time, duration, concentration or price
+    parsed from the text around a drug. A range ("2-3 pills") keeps its
+    upper bound as value; a time's value is the hour on a 24-hour clock.
+    """
+
+    kind: str  # "dose", "count", "route", "frequency", "time", "duration",
+               # "concentration" or "price"
+    value: Optional[float]
+    unit: Optional[str]
+    surface: str
+
+
+# Units after a number ("2mg", "1.5 grams") -> normalised unit
+DOSE_UNITS = {
+    "mg": "mg", "g": "g", "gram": "g", "grams": "g", "kg": "kg",
+    "ug": "ug", "mcg": "ug", "µg": "ug",
+    "ml": "ml", "mls": "ml", "cl": "cl", "l": "l",
+    "litre": "l", "litres": "l", "liter": "l", "liters": "l",
+    "oz": "oz", "pint": "pint", "pints": "pint",
+    "iu": "units", "unit": "units", "units": "units", "%": "%",
+}
+
+# Counted things after a number ("4 cans", "10 tabs") -> normalised unit.
+# Only counted when a number comes first: a bare "tabs" is still LSD slang.
+COUNT_UNITS = {
+    "can": "can", "cans": "can", "tab": "tab", "tabs": "tab",
+    "pill": "pill", "pills": "pill", "cap": "cap", "caps": "cap",
+    "line": "line", "lines": "line", "bag": "bag", "bags": "bag",
+    "point": "point", "points": "point", "bump": "bump", "bumps": "bump",
+    "hit": "hit", "hits": "hit", "drop": "drop", "drops": "drop",
+    "blotter": "blotter", "blotters": "blotter", "dose": "dose", "doses": "dose",
+    "bottle": "bottle", "bottles": "bottle", "shot": "shot", "shots": "shot",
+    "puff": "puff", "puffs": "puff", "times": "x", "x": "x",
+}
+
+# Units of time after a number ("2hrs", "30 mins") -> normalised unit
+DURATION_UNITS = {
+    "s": "s", "sec": "s", "secs": "s", "second": "s", "seconds": "s",
+    "min": "min", "mins": "min", "minute": "min", "minutes": "min",
+    "h": "h", "hr": "h", "hrs": "h", "hour": "h", "hours": "h",
+    "day": "day", "days": "day", "week": "week", "weeks": "week",
+}
+
+# Money: "£20", "$20", "20 quid" -> currency
+CURRENCY_SYMBOLS = {"£": "gbp", "$": "usd", "€": "eur"}
+CURRENCY_WORDS = {
+    "quid": "gbp", "pound": "gbp", "pounds": "gbp",
+    "dollar": "usd", "dollars": "usd", "euro": "eur", "euros": "eur",
+}
+
+# Route of administration words -> normalised route
+ROUTE_WORDS = {
+    "iv": "iv", "injected": "iv", "injecting": "iv", "iv'd": "iv",
+    "sc": "sc", "subcut": "sc",
+    "po": "oral", "oral": "oral", "orally": "oral", "swallowed": "oral",
+    "drank": "oral",
+    "snorted": "intranasal", "sniffed": "intranasal", "railed": "intranasal",
+    "insufflated": "intranasal", "intranasal": "intranasal",
+    "smoked": "smoked", "smoking": "smoked", "chased": "smoked",
+    "vaped": "smoked", "vaping": "smoked", "dabbed": "smoked",
+    "sl": "sublingual", "sublingual": "sublingual",
+    "pr": "rectal", "rectal": "rectal", "rectally": "rectal",
+    "boofed": "rectal", "plugged": "rectal",
+}
+
+# Frequency words -> normalised frequency. "bd" is deliberately absent:
+# it is a TripSit alias for 1,4-butanediol.
+FREQUENCY_WORDS = {
+    "tds": "tds", "tid": "tds", "qds": "qds", "qid": "qds", "bid": "bd",
+    "prn": "prn", "nocte": "nocte", "mane": "mane", "once": "once",
+    "twice": "twice", "daily": "daily", "nightly": "nightly",
+    "hourly": "hourly", "weekly": "weekly",
+}
+
+_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+_NUMBER_UNIT_PATTERN = re.compile(r"(\d+(?:\.\d+)?)([a-zµ%]+)")
+_TIMES_PATTERN = re.compile(r"x(\d+)|(\d+)x")
+_CLOCK_PATTERN = re.compile(r"(\d{1,2})(?::(\d{2}))?(am|pm)|(\d{1,2}):(\d{2})")
+_RANGE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)-(\d+(?:\.\d+)?)([a-zµ%]*)")
+_FRACTION_PATTERN = re.compile(r"(\d+)/(\d+)([a-zµ%]*)")
+_RATIO_PATTERN = re.compile(r"(\d+(?:\.\d+)?)([a-zµ%]+)/([a-zµ%]+)")
+_PRICE_PATTERN = re.compile(r"([£$€])(\d+(?:\.\d+)?)")
+
+
+def _clock_hour(hour: int, minute: int, meridiem: Optional[str]) -> Optional[float]:
+    """Hour of the day (0-24) for a clock time, or None if it is not one."""
+    if minute > 59:
+        return None
+    if meridiem is None:
+        return hour + minute / 60 if hour <= 23 else None
+    if not 1 <= hour <= 12:
+        return None
+    return hour % 12 + (12 if meridiem == "pm" else 0) + minute / 60
+
+
+def _unit_quantity(value: float, unit: str, surface: str) -> Optional[Quantity]:
+    """Quantity for a number followed by a dose, count or duration unit."""
+    if unit == "":
+        return Quantity("count", value, None, surface)
+    if unit in DOSE_UNITS:
+        return Quantity("dose", value, DOSE_UNITS[unit], surface)
+    if unit in COUNT_UNITS:
+        return Quantity("count", value, COUNT_UNITS[unit], surface)
+    if unit in DURATION_UNITS:
+        return Quantity("duration", value, DURATION_UNITS[unit], surface)
+    return None
+
+
+def classify_quantity(
+    token: str, next_token: Optional[str] = None
+) -> Optional[Tuple[Quantity, int]]:
+    """
+    Parse a lowercased token (and, for a bare number, the unit token after
+    it) as a dose, count, route, frequency, clock time ("10am", "22:30"),
+    duration ("2hrs"), range ("2-3"), fraction ("1/2"), concentration
+    ("20mg/ml") or price ("£20", "20 quid"). Returns (Quantity, tokens
+    used) or None if the token is not one. Callers check drug labels first:
+    "25g" and "x" are drugs, not 25 grams or a count.
+    """
+    if token in ROUTE_WORDS:
+        return Quantity("route", None, ROUTE_WORDS[token], token), 1
+    if token in FREQUENCY_WORDS:
+        return Quantity("frequency", None, FREQUENCY_WORDS[token], token), 1
+
+    if _NUMBER_PATTERN.fullmatch(token):
+        value = float(token)
+        surface = f"{token} {next_token}"
+        if next_token in ("am", "pm") and "." not in token:
+            hour = _clock_hour(int(token), 0, next_token)
+            if hour is not None:
+                return Quantity("time", hour, None, surface), 2
+        if next_token in CURRENCY_WORDS:
+            return Quantity("price", value, CURRENCY_WORDS[next_token], surface), 2
+        if next_token:
+            quantity = _unit_quantity(value, next_token, surface)
+            if quantity is not None:
+                return quantity, 2
+        return Quantity("count", value, None, token), 1
+
+    m = _NUMBER_UNIT_PATTERN.fullmatch(token)
+    if m is not None:
+        quantity = _unit_quantity(float(m.group(1)), m.group(2), token)
+        if quantity is not None:
+            return quantity, 1
+
+    m = _TIMES_PATTERN.fullmatch(token)
+    if m is not None:
+        return Quantity("count", float(m.group(1) or m.group(2)), "x", token), 1
+
+    m = _CLOCK_PATTERN.fullmatch(token)
+    if m is not None:
+        if m.group(3):
+            hour = _clock_hour(int(m.group(1)), int(m.group(2) or 0), m.group(3))
+        else:
+            hour = _clock_hour(int(m.group(4)), int(m.group(5)), None)
+        if hour is not None:
+            return Quantity("time", hour, None, token), 1
+
+    m = _RANGE_PATTERN.fullmatch(token)
+    if m is not None:
+        quantity = _unit_quantity(float(m.group(2)), m.group(3), token)
+        if quantity is not None:
+            return quantity, 1
+
+    m = _FRACTION_PATTERN.fullmatch(token)
+    if m is not None and int(m.group(2)) != 0:
+        value = int(m.group(1)) / int(m.group(2))
+        quantity = _unit_quantity(value, m.group(3), token)
+        if quantity is not None:
+            return quantity, 1
+
+    m = _RATIO_PATTERN.fullmatch(token)
+    if m is not None and m.group(2) in DOSE_UNITS and m.group(3) in DOSE_UNITS:
+        unit = f"{DOSE_UNITS[m.group(2)]}/{DOSE_UNITS[m.group(3)]}"
+        return Quantity("concentration", float(m.group(1)), unit, token), 1
+
+    m = _PRICE_PATTERN.fullmatch(token)
+    if m is not None:
+        return Quantity("price", float(m.group(2)), CURRENCY_SYMBOLS[m.group(1)], token), 1
+
+    return None
+
+
+def _is_drug_label(token: str) -> bool:
+    """True if token is a base, TripSit, slang or alias label."""
+    return (
+        token in BASE_DRUG_CONFIG
+        or token in TRIPSIT_DRUG_NAMES
+        or token in SLANG_MAP
+        or token in NORMALISATION_MAP
+    )
+
+
+class TokenTrie:
+    """
+    Token-level trie over every canonical name, alias, slang entry and
+    phrase, each split with split_tokens(). Multi-word entries such as
+    "fent analog" or "1,4-bd" (which the comma splits in two) are matched
+    longest-first while walking the token stream once.
+    Each node is [children: {token: node}, label_or_None].
+
+    This is how PHRASE_NORMALISATION is applied: one left-to-right pass
+    with leftmost-longest matches ("synthetic cannabinoids" beats
+    "synthetic cannabinoid"), on whole tokens only. It replaced a
+    character-level Aho-Corasick automaton that rewrote the text before
+    tokenising, which the streaming tokeniser made redundant.
+    """
+
+    def __init__(self, labels: Iterable[str] = ()) -> None:
+        self.root: list = [{}, None]
+        self.max_depth = 1
+        for label in labels:
+            self.add(label)
+
+    def add(self, label: str) -> None:
+        node = self.root
+        depth = 0
+        for token in split_tokens(label):
+            child = node[0].get(token)
+            if child is None:
+                child = [{}, None]
+                node[0][token] = child
+            node = child
+            depth += 1
+        if node is not self.root:
+            node[1] = label
+            self.max_depth = max(self.max_depth, depth)
+
+    def longest_match(self, tokens: List[str], start: int) -> Tuple[int, Optional[str]]:
+        """(number_of_tokens, label) of the longest entry starting at tokens[start]."""
+        node = self.root
+        best: Tuple[int, Optional[str]] = (0, None)
+        for pos in range(start, len(tokens)):
+            node = node[0].get(tokens[pos])
+            if node is None:
+                break
+            if node[1] is not None:
+                best = (pos - start + 1, node[1])
+        return best
+
+
+_TOKEN_TRIE: Optional[TokenTrie] = None
+_TOKEN_TRIE_VERSION: Optional[Tuple[int, int, int]] = None
+
+
+def get_token_trie() -> TokenTrie:
+    """
+    The TokenTrie for the current config, rebuilt when CONFIG_VERSION,
+    TAGGING_VERSION or ALIAS_GENERATION changes.
+    """
+    global _TOKEN_TRIE, _TOKEN_TRIE_VERSION
+    version = (CONFIG_VERSION, TAGGING_VERSION, ALIAS_GENERATION)
+    if _TOKEN_TRIE is None or _TOKEN_TRIE_VERSION != version:
+        labels = (
+            set(BASE_DRUG_CONFIG)
+            | {name for name, info in DRUG_CONFIG.items() if info["category"] != "unknown"}
+            | set(SLANG_MAP)
+            | set(NORMALISATION_MAP)
+            | set(PHRASE_NORMALISATION)
+        )
+        _TOKEN_TRIE = TokenTrie(sorted(labels))
+        _TOKEN_TRIE_VERSION = version
+    return _TOKEN_TRIE
 
-        # Skip empty tokens and filler words like "and"
-        if not token or token in STOPWORDS:
+
+def _segment_window() -> int:
+    """Tokens of lookahead _iter_tagged_tokens needs for one decision."""
+    # "1.5 grams" is one quantity, "mdmb 4en pinaca" one folded key
+    return max(get_token_trie().max_depth, FOLD_MAX_TOKENS, 2)
+
+
+def _is_fold_piece(token: str, previous: Optional[str]) -> bool:
+    """
+    True if token may be a piece of a multi-token folded key (previous is
+    the piece before it, None for the first). Pieces have a letter and more
+    than one character and are not stopwords, ordinary words, quantities or
+    time words ("what do i do" is not DOI, "at 6 am" is not 6-AM). Two
+    chemical-name shapes are let through: a leading position number
+    ("4 aco dmt") and one letter after a digit-letter piece ("2c b").
+    """
+    token = token.lower()
+    if (
+        token in STOPWORDS
+        or token in FOLD_TIME_WORDS
+        or token in DOSE_UNITS
+        or token in COUNT_UNITS
+        or is_non_drug_word(token)
+    ):
+        return False
+    if previous is None and token.isdigit():
+        return True
+    if len(token) == 1 and token.isalpha() and previous is not None:
+        previous = previous.lower()
+        return any(c.isdigit() for c in previous) and any(c.isalpha() for c in previous)
+    return (
+        len(token) > 1
+        and any(c.isalpha() for c in token)
+        and classify_quantity(token) is None
+    )
+
+
+def _folded_match(window: "deque[Tuple[str, int, int]]") -> Tuple[int, str]:
+    """
+    (number of tokens, folded key) for the longest run of up to
+    FOLD_MAX_TOKENS tokens at the start of window that joins into a
+    FOLD_INDEX key, or (0, ""). Only _is_fold_piece tokens are joined.
+    """
+    if FOLD_INDEX is None:
+        rebuild_fold_index()
+    key = ""
+    best = (0, "")
+    for i in range(min(len(window), FOLD_MAX_TOKENS)):
+        if i == 1 and not _is_fold_piece(window[0][0], None):
+            break
+        if i >= 1 and not _is_fold_piece(window[i][0], window[i - 1][0]):
+            break
+        key += fold_label(window[i][0])
+        if key in FOLD_INDEX:
+            best = (i + 1, key)
+        elif key not in _FOLD_PREFIXES:
+            break
+    return best
+
+
+def _iter_tagged_segments(
+    source: Union[str, Iterable[str]]
+) -> Iterator[Tuple[str, int, int, Optional[Quantity]]]:
+    """
+    iter_segments, plus the quantity/route/frequency tokens it holds back:
+    those are yielded as (surface, start, end, Quantity), drug segments as
+    (segment, start, end, None).
+    """
+    return _iter_tagged_tokens(iter_tokens(source))
+
+
+def _iter_tagged_tokens(
+    tokens: Iterator[Tuple[str, int, int]]
+) -> Iterator[Tuple[str, int, int, Optional[Quantity]]]:
+    """_iter_tagged_segments over an iter_tokens-style token stream."""
+    trie = get_token_trie()
+    depth = _segment_window()
+    window: "deque[Tuple[str, int, int]]" = deque()
+
+    while True:
+        while len(window) < depth:
+            nxt = next(tokens, None)
+            if nxt is None:
+                break
+            window.append(nxt)
+        if not window:
+            return
+
+        length, label = trie.longest_match([t[0] for t in window], 0)
+        if length > 1:
+            start = window[0][1]
+            end = window[length - 1][2]
+            for _ in range(length):
+                window.popleft()
+            yield PHRASE_NORMALISATION.get(label, label), start, end, None
             continue
 
-        canonical, cat, score, is_unknown = get_drug_info(token)
+        token, start, end = window[0]
+
+        # Doses, counts, routes and frequencies are parsed, never resolved
+        parsed = classify_quantity(token, window[1][0] if len(window) > 1 else None)
+        if parsed is not None and _is_drug_label(token):
+            parsed = None
+        elif parsed is not None and parsed[1] == 2 and _is_drug_label(window[1][0]):
+            # "2 tabs", "2 x": the unit is slang for the drug; count it.
+            # A bare x before another number is a times sign ("2 x 20mg")
+            times_sign = (
+                parsed[0].unit == "x"
+                and len(window) > 2
+                and window[2][0][:1].isdigit()
+            )
+            if not times_sign:
+                parsed = Quantity("count", parsed[0].value, None, token), 1
+
+        # Split spellings of one name ("5f adb", "2c b"), unless it is a
+        # number and unit ("25 g" is a dose, not 25g-nbome)
+        if parsed is None or parsed[1] == 1:
+            length, key = _folded_match(window)
+            if length > 1:
+                end = window[length - 1][2]
+                for _ in range(length):
+                    window.popleft()
+                yield key, start, end, None
+                continue
+
+        # Skip filler words like "and", and bare punctuation ("2 - 3")
+        if token in STOPWORDS or not any(ch.isalnum() for ch in token):
+            window.popleft()
+            continue
+
+        if parsed is not None:
+            quantity, used = parsed
+            end = window[used - 1][2]
+            for _ in range(used):
+                window.popleft()
+            yield quantity.surface, start, end, quantity
+            continue
+
+        window.popleft()
+
+        # Common non-drug words never reach fuzzy matching
+        if is_non_drug_word(token):
+            NON_DRUG_STATS["short_circuited"] += 1
+            continue
+
+        yield PHRASE_NORMALISATION.get(token, token), start, end, None
+
+
+def iter_segments(source: Union[str, Iterable[str]]) -> Iterator[Tuple[str, int, int]]:
+    """
+    First half of extract_drugs, streamed: yields (segment, start, end) for
+    each string to resolve with get_drug_info, in order. Multi-word entries
+    (including PHRASE_NORMALISATION phrases, which are replaced by their
+    target) are matched longest-first on a sliding window of
+    TokenTrie.max_depth tokens; STOPWORDS, NON_DRUG_WORDS and quantity
+    tokens (see classify_quantity) are dropped. source is anything
+    iter_tokens accepts.
+    """
+    for segment, start, end, quantity in _iter_tagged_segments(source):
+        if quantity is None:
+            yield segment, start, end
+
+
+def segment_text(text: Union[str, Iterable[str]]) -> List[str]:
+    """The segments of iter_segments, without offsets."""
+    return [segment for segment, _, _ in iter_segments(text)]
+
+
+class DrugSpans(NamedTuple):
+    """
+    Span table for one extract_drugs call: parallel lists with one entry per
+    detection, in text order. start/end are character offsets into the input
+    and surface is the input text between them; path is the
+    TokenResolution path, or "alias" for PHRASE_NORMALISATION phrases.
+    quantities holds the Quantity tokens attached to each detection.
+    """
+
+    start: List[int]
+    end: List[int]
+    surface: List[str]
+    canonical: List[str]
+    path: List[str]
+    quantities: List[List[Quantity]]
+
+
+# A comma, semicolon, newline or sentence end between two tokens separates
+# clauses; quantities are not attached to a drug across one.
+_CLAUSE_BREAK = re.compile(r"[,;\n]|[.!?](?=\s|$)")
+
+
+def _read_source(source: Union[str, Iterable[str]]) -> str:
+    """Materialise anything iter_tokens accepts into one string."""
+    if isinstance(source, str):
+        return source
+    if hasattr(source, "read"):
+        return source.read()
+    return "".join(source)
+
+
+def _collect_drugs(
+    segments: List[str], resolved: Dict[str, TokenResolution]
+) -> Tuple[List[str], List[str]]:
+    """Build the (detected, unknowns) lists from resolved segments."""
+    detected: List[str] = []
+    unknowns: List[str] = []
+
+    for segment in segments:
+        canonical, cat, score, is_unknown = resolved[segment][:4]
         detected.append(canonical)
 
         if is_unknown:
@@ -864,6 +3946,268 @@ def extract_drugs(text: str) -> Tuple[List[str], List[str]]:
     return detected, unknowns
 
 
+def _build_spans(
+    text: str,
+    tagged: List[Tuple[str, int, int, Optional[Quantity]]],
+    resolved: Dict[str, TokenResolution],
+) -> DrugSpans:
+    """
+    Build the DrugSpans table from the _iter_tagged_segments output for text.
+    Doses and counts attach to the next drug in the same clause ("2mg
+    xanax"), routes and frequencies to the previous one ("heroin iv"); each
+    falls back to the other side, and is dropped if neither exists.
+    """
+    spans = DrugSpans([], [], [], [], [], [])
+    drug_rows: List[int] = []  # span row per tagged item, -1 for quantities
+    for segment, start, end, quantity in tagged:
+        if quantity is not None:
+            drug_rows.append(-1)
+            continue
+        surface = text[start:end]
+        res = resolved[segment]
+        if " ".join(split_tokens(surface)) in PHRASE_NORMALISATION:
+            path = "alias"
+        else:
+            path = res.path
+        drug_rows.append(len(spans.start))
+        spans.start.append(start)
+        spans.end.append(end)
+        spans.surface.append(surface)
+        spans.canonical.append(res.canonical)
+        spans.path.append(path)
+        spans.quantities.append([])
+
+    # Nearest drug item on each side of every position
+    n = len(tagged)
+    prev_drug = [-1] * n
+    next_drug = [-1] * n
+    last = -1
+    for i in range(n):
+        prev_drug[i] = last
+        if drug_rows[i] >= 0:
+            last = i
+    last = -1
+    for i in range(n - 1, -1, -1):
+        next_drug[i] = last
+        if drug_rows[i] >= 0:
+            last = i
+
+    for i, (_, start, end, quantity) in enumerate(tagged):
+        if quantity is None:
+            continue
+        before = prev_drug[i]
+        if before >= 0 and _CLAUSE_BREAK.search(text, tagged[before][2], start):
+            before = -1
+        after = next_drug[i]
+        if after >= 0 and _CLAUSE_BREAK.search(text, end, tagged[after][1]):
+            after = -1
+        if quantity.kind in ("dose", "count", "concentration", "price"):
+            target = after if after >= 0 else before
+        else:
+            target = before if before >= 0 else after
+        if target >= 0:
+            spans.quantities[drug_rows[target]].append(quantity)
+
+    return spans
+
+
+def extract_drugs(
+    text: Union[str, Iterable[str]], with_spans: bool = False
+) -> Union[Tuple[List[str], List[str]], Tuple[List[str], List[str], DrugSpans]]:
+    """
+    Parse free text and return:
+      - list of canonical drugs,
+      - list of 'unknown category' drugs,
+      - with_spans=True only: a DrugSpans table locating each detection,
+        with the doses/routes/frequencies written next to it.
+      STOPWORDS (e.g. 'and', 'with'), NON_DRUG_WORDS and quantity tokens
+      ('0.2g', 'iv', 'x3') are never resolved as drugs.
+    text may also be an iterable of chunks or a file object (see iter_tokens);
+    with_spans reads it into memory first to fill in the surface forms.
+    """
+    if with_spans:
+        text = _read_source(text)
+    tagged = list(_iter_tagged_segments(text))
+    segments = [segment for segment, _, _, quantity in tagged if quantity is None]
+    resolved = {segment: resolve_drug_token(segment) for segment in segments}
+    detected, unknowns = _collect_drugs(segments, resolved)
+    if with_spans:
+        return detected, unknowns, _build_spans(text, tagged, resolved)
+    return detected, unknowns
+
+
+def extract_drugs_many(
+    texts: Iterable[str], with_spans: bool = False
+) -> List[Union[Tuple[List[str], List[str]], Tuple[List[str], List[str], DrugSpans]]]:
+    """
+    extract_drugs for a batch of texts. All texts are tokenised first, the
+    distinct tokens across the whole batch are resolved once each (in order
+    of first appearance, see resolve_drug_tokens), and the results are
+    scattered back per text, so resolution cost scales with the batch
+    vocabulary rather than its size.
+    """
+    texts = [_read_source(text) for text in texts] if with_spans else list(texts)
+    all_tagged = [list(_iter_tagged_segments(text)) for text in texts]
+
+    resolved = resolve_drug_tokens(
+        segment for tagged in all_tagged for segment, _, _, quantity in tagged
+        if quantity is None
+    )
+
+    results = []
+    for text, tagged in zip(texts, all_tagged):
+        segments = [segment for segment, _, _, quantity in tagged if quantity is None]
+        detected, unknowns = _collect_drugs(segments, resolved)
+        if with_spans:
+            results.append((detected, unknowns, _build_spans(text, tagged, resolved)))
+        else:
+            results.append((detected, unknowns))
+    return results
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    """Length of the common prefix of a and b, comparing slices."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix_len(a: str, b: str, limit: int) -> int:
+    """Length of the common suffix of a and b, at most limit."""
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class IncrementalExtractor:
+    """
+    extract_drugs for text that changes a little at a time (live input).
+    update(text) diffs the text against the previous call, re-tokenises only
+    the edited region (plus enough segments either side for multi-word and
+    quantity matches) and resolves only segments it has not seen before.
+    The rest of the segment list is reused, so tokenising and resolution
+    cost scale with the edit, not the note. Results are the same as
+    extract_drugs(text). stats counts reused / rescanned / resolved segments.
+    """
+
+    def __init__(self) -> None:
+        self.stats = {"updates": 0, "reused": 0, "rescanned": 0, "resolved": 0}
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the previous text; the next update is a full extraction."""
+        self.text = ""
+        self.tagged: List[Tuple[str, int, int, Optional[Quantity]]] = []
+        self.resolved: Dict[str, TokenResolution] = {}
+        self.config_version = CONFIG_VERSION
+        self.label_generation = LABEL_GENERATION
+        self.tagging_version = (TAGGING_VERSION, ALIAS_GENERATION)
+
+    def update(
+        self, text: str, with_spans: bool = False
+    ) -> Union[Tuple[List[str], List[str]], Tuple[List[str], List[str], DrugSpans]]:
+        """Set the current text and return extract_drugs(text, with_spans)."""
+        if self.config_version != CONFIG_VERSION:
+            # token trie, lexicon and labels may all have changed
+            self.reset()
+        elif self.tagging_version != (TAGGING_VERSION, ALIAS_GENERATION):
+            # labels were updated in place: re-tag, keep what is still resolved
+            self.text, self.tagged = "", []
+            self.tagging_version = (TAGGING_VERSION, ALIAS_GENERATION)
+        if self.label_generation != LABEL_GENERATION:
+            # as in TOKEN_CACHE, only identity resolutions survive new labels,
+            # unless the label itself was updated (see invalidate_labels)
+            stale = labels_invalidated_since(self.label_generation)
+            self.resolved = {
+                segment: res
+                for segment, res in self.resolved.items()
+                if res.canonical == segment and segment not in stale
+            }
+            self.label_generation = LABEL_GENERATION
+
+        self.tagged = self._retag(text)
+        self.text = text
+        self.stats["updates"] += 1
+
+        segments = [segment for segment, _, _, quantity in self.tagged if quantity is None]
+        resolved: Dict[str, TokenResolution] = {}
+        for segment in segments:
+            if segment in resolved:
+                continue
+            res = self.resolved.get(segment)
+            if res is None:
+                res = resolve_drug_token(segment)
+                self.stats["resolved"] += 1
+            resolved[segment] = res
+        self.resolved = resolved
+
+        detected, unknowns = _collect_drugs(segments, resolved)
+        if with_spans:
+            return detected, unknowns, _build_spans(text, self.tagged, resolved)
+        return detected, unknowns
+
+    def _retag(self, text: str) -> List[Tuple[str, int, int, Optional[Quantity]]]:
+        """_iter_tagged_segments(text), reusing the unchanged ends of self.tagged."""
+        old, old_tagged = self.text, self.tagged
+        if not old_tagged:
+            tagged = list(_iter_tagged_segments(text))
+            self.stats["rescanned"] += len(tagged)
+            return tagged
+
+        prefix = _common_prefix_len(old, text)
+        suffix = _common_suffix_len(old, text, min(len(old), len(text)) - prefix)
+
+        # Restart a full window of segments before the last separator ahead
+        # of the edit: no decision before that point looked at edited tokens.
+        sep = _last_separator(old, prefix)
+        ends = [item[2] for item in old_tagged]
+        k = bisect.bisect_right(ends, sep) - _segment_window()
+        if k <= 0:
+            k, lo = 0, 0
+        else:
+            lo = old_tagged[k][1]
+
+        # Past the edit, once re-tagging reaches the start of an old segment
+        # (whose preceding character is unchanged) the rest is identical.
+        shift = len(text) - len(old)
+        tail_from = len(old) - suffix + 1
+        starts = [item[1] for item in old_tagged]
+        j = bisect.bisect_left(starts, max(tail_from, lo))
+
+        tokens = (
+            (m.group().lower(), m.start(), m.end())
+            for m in _TOKEN_PATTERN.finditer(text, lo)
+        )
+        middle: List[Tuple[str, int, int, Optional[Quantity]]] = []
+        tail: List[Tuple[str, int, int, Optional[Quantity]]] = []
+        for item in _iter_tagged_tokens(tokens):
+            old_start = item[1] - shift
+            if old_start >= tail_from:
+                while j < len(starts) and starts[j] < old_start:
+                    j += 1
+                if j < len(starts) and starts[j] == old_start:
+                    tail = [
+                        (segment, start + shift, end + shift, quantity)
+                        for segment, start, end, quantity in old_tagged[j:]
+                    ]
+                    break
+            middle.append(item)
+
+        self.stats["reused"] += k + len(tail)
+        self.stats["rescanned"] += len(middle)
+        return old_tagged[:k] + middle + tail
+
+
 def compute_drug_score(drugs: List[str]) -> Tuple[int, int, int]:
     """
     Compute:
@@ -1154,8 +4498,47 @@ def triage_from_text_and_context(text: str, context: dict) -> dict:
     """
     Master function: combines drugs, TripSit penalties, context, LCMS priority,
     and tailored recommendations into one output dict.
+    Waits for a background warm-up first (see ensure_ready) and runs on
+    one config even if a reload happens meanwhile (see KB_LOCK).
+    """
+    ensure_ready(WARMUP_TIMEOUT)
+    with KB_LOCK.read():
+        drugs, unknowns, spans = extract_drugs(text, with_spans=True)
+        return _triage_from_drugs(drugs, unknowns, context, spans)
+
+
+def triage_many(records: Iterable[dict]) -> List[dict]:
+    """
+    Triage a batch of records, each a dict with 'text' and optional
+    'context' (e.g. parsed JSONL lines). Drug extraction goes through
+    extract_drugs_many, so each distinct token is resolved once per batch.
+    Results are returned in record order.
     """
-    drugs, unknowns = extract_drugs(text)
+    ensure_ready(WARMUP_TIMEOUT)
+    records = list(records)
+    with KB_LOCK.read():
+        extracted = extract_drugs_many(
+            (record.get("text") or "" for record in records), with_spans=True
+        )
+        return [
+            _triage_from_drugs(drugs, unknowns, record.get("context") or {}, spans)
+            for record, (drugs, unknowns, spans) in zip(records, extracted)
+        ]
+
+
+def drug_quantities(spans: DrugSpans) -> Dict[str, List[str]]:
+    """Canonical drug -> surface forms of the quantities attached to it."""
+    out: Dict[str, List[str]] = {}
+    for canonical, quantities in zip(spans.canonical, spans.quantities):
+        if quantities:
+            out.setdefault(canonical, []).extend(q.surface for q in quantities)
+    return out
+
+
+def _triage_from_drugs(
+    drugs: List[str], unknowns: List[str], context: dict, spans: Optional[DrugSpans] = None
+) -> dict:
+    """Scoring, recommendations and referral for already-extracted drugs."""
     drug_score, synergy_component, tripsit_component = compute_drug_score(drugs)
     ctx_score, ctx_reasons = compute_context_modifier(context, drugs)
     total_score = drug_score + ctx_score
@@ -1187,6 +4570,8 @@ def triage_from_text_and_context(text: str, context: dict) -> dict:
     return {
         "detected_drugs": drugs,
         "unknown_drugs": unknowns,
+        "drug_quantities": drug_quantities(spans) if spans is not None else {},
+        "snapshot_version": SNAPSHOT_VERSION,
         "drug_score": drug_score,
         "synergy_component": synergy_component,
         "tripsit_combo_component": tripsit_component,